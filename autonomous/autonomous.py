@@ -1,6 +1,7 @@
 
 from magicbot.state_machine import AutonomousStateMachine, state
 from components.chassis import Chassis, constrain_angle
+from components.motion_profile import profile_for
 from components import shooter
 from components import intake
 from components import defeater
@@ -32,6 +33,9 @@ class ObstacleHighGoal(AutonomousStateMachine):
         # Rescale velocity components to get a combined magnitude of 1
         self.vx = delta_x / self.strafe_distance
         self.vy = delta_y / self.strafe_distance
+        # Work out the moves now rather than in the middle of autonomous
+        profile_for(self.straight)
+        profile_for(self.strafe_distance)
         self.logger = logging.getLogger("auto")
 
     def on_enable(self):
@@ -69,7 +73,7 @@ class ObstacleHighGoal(AutonomousStateMachine):
 
     @state(must_finish=True)
     def breach_defence(self):
-        if self.chassis.distance_pid.onTarget():
+        if self.chassis.on_displace_target():
             self.chassis.distance_pid.disable()
             # Let the distance PID do its magic...
             # Turn off the distance PID, and spin to the right angle
@@ -88,7 +92,7 @@ class ObstacleHighGoal(AutonomousStateMachine):
 
     @state(must_finish=True)
     def strafing(self):
-        if self.chassis.distance_pid.onTarget():
+        if self.chassis.on_displace_target():
             # Dead reckoning is done - engage the rangefinder
             # Leave the distance PID running as it will read the rf for us
             self.chassis.distance_pid.setOutputRange(-0.4, 0.4)
@@ -223,12 +227,18 @@ class ApproachObstacle(AutonomousStateMachine):
     MODE_NAME = "Approach Obstacle"
     chassis = Chassis
 
+    def __init__(self):
+        super().__init__()
+        self.distance = 1.1
+        # Work out the move now rather than in the middle of autonomous
+        profile_for(self.distance)
+
     @state(first=True)
     def drive_forward(self):
-        self.chassis.field_displace(1.1, 0.0)
+        self.chassis.field_displace(self.distance, 0.0)
         self.engage('driving_forward')
 
     @state(must_finish=True)
     def driving_forward(self):
-        if self.chassis.distance_pid.onTarget():
+        if self.chassis.on_displace_target():
             self.done()
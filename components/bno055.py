@@ -4,14 +4,19 @@ from wpilib import GyroBase
 import hal
 import math
 
+from .history import TimestampedHistory
+
 import logging
 
 
 class BNO055(GyroBase):
     """Class to read euler values in radians from the I2C bus"""
 
+    history_size = 50  # About a second of headings at 50Hz
+
     def __init__(self, port=None, address=None):
         super().__init__()
+        self.history = TimestampedHistory(self.history_size, angle=True)
         self.address = address
         self.port = port
         if self.address is None:
@@ -108,6 +113,20 @@ class BNO055(GyroBase):
 
     def resetHeading(self, heading=math.pi):
         self.offset = self.getRawHeading() - heading
+        # The old headings are relative to the old offset
+        self.history.clear()
+
+    def updateHistory(self, timestamp):
+        """Record the current heading at timestamp, and return it"""
+        heading = self.getHeading()
+        self.history.append(timestamp, heading)
+        return heading
+
+    def getHeadingAt(self, timestamp):
+        """Heading at timestamp, from the history"""
+        if not len(self.history):
+            return self.getHeading()
+        return self.history.at(timestamp)
 
     def execute(self):
         pass  # Keep MagicBot happy!
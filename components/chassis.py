@@ -2,12 +2,16 @@
 import math
 import logging
 
-from wpilib import CANTalon, PIDController
+from wpilib import CANTalon, PIDController, Timer
 from wpilib.interfaces import PIDOutput, PIDSource
 
 from .bno055 import BNO055
 from .vision import Vision
 from .range_finder import RangeFinder
+from .odometry import SwerveOdometry
+from .kinematics import SwerveKinematics
+from .snapshot import CachedCANTalon
+from .motion_profile import profile_for
 
 
 class BlankPIDOutput(PIDOutput):
@@ -26,6 +30,10 @@ class Chassis:
 
     vision_scale_factor = 0.3  # units of m/(vision unit)
     distance_pid_abs_error = 0.05  # metres
+    history_size = 50  # About a second of positions at 50Hz
+    vision_min_confidence = 0.5
+    # Speed at full output: 570 counts per 100ms at 1672 counts/m
+    max_speed = 3.4  # m/s
 
     motor_dist = math.sqrt((width / 2) ** 2 + (length / 2) ** 2)  # distance of motors from the center of the robot
 
@@ -85,6 +93,7 @@ class Chassis:
         for name, params in Chassis.module_params.items():
             self._modules[name] = SwerveModule(**(params['args']))
             self._modules[name]._drive.setVoltageRampRate(50.0)
+        self.kinematics = SwerveKinematics(Chassis.module_params)
         self.field_oriented = True
         self.inputs = [0.0, 0.0, 0.0, 0.0]
         self.vx = self.vy = self.vz = 0.0
@@ -96,7 +105,7 @@ class Chassis:
         import robot
         self.rescale_js = robot.rescale_js
 
-        self.distance_pid_heading = 0.0  # Relative to field
+        self.distance_pid_heading = 0.0  # Relative to the robot
         self.distance_pid_output = BlankPIDOutput()
         # TODO tune the distance PID values
         self.distance_pid = PIDController(0.75, 0.02, 1.0,
@@ -111,6 +120,16 @@ class Chassis:
         self.pid_counter = 0
         self.logger = logging.getLogger("chassis")
 
+        # Where we are and have been, in metres relative to the field, so
+        # vision measurements can be brought up to date
+        self.odometry = SwerveOdometry(self.history_size)
+        self.position_history = self.odometry.positions
+        # Where the distance PID is measuring from
+        self._origin = (0.0, 0.0)
+        # The motion profile field_displace is following, if any
+        self.profile = None
+        self.profile_start = 0.0
+
     def on_enable(self):
         self.bno055.resetHeading()
         self.heading_hold = True
@@ -149,8 +168,10 @@ class Chassis:
             self.range_setpoint = 0.0
 
     def zero_encoders(self):
-        for module in self._modules.values():
-            module.zero_distance()
+        """Measure distance from where we are now, for a new move. The
+        encoders keep counting, as the odometry needs them to."""
+        self._origin = (self.odometry.x, self.odometry.y)
+        self.profile = None
 
     def field_displace(self, x, y):
         '''Use the distance PID to displace the robot by x,y
@@ -160,10 +181,17 @@ class Chassis:
         self.distance_pid_heading = math.atan2(fy, fx)
         self.distance_pid.disable()
         self.zero_encoders()
-        self.distance_pid.setSetpoint(d)
+        # Follow the profile, then leave the distance PID to finish off
+        self.profile = profile_for(d)
+        self.profile_start = Timer.getFPGATimestamp()
+        self.distance_pid.setSetpoint(0.0)
         self.distance_pid.reset()
         self.distance_pid.enable()
 
+    def on_displace_target(self):
+        """Has the move from field_displace finished?"""
+        return self.profile is None and self.distance_pid.onTarget()
+
     def pidGet(self):
         return self.distance
 
@@ -172,47 +200,64 @@ class Chassis:
 
     @property
     def distance(self):
-        distances = 0.0
-        for module in self._modules.values():
-            distances += abs(module.distance) / module.drive_counts_per_metre
-        return distances / 4.0
+        """How far we have moved since zero_encoders() in the direction the
+        distance PID is driving, in metres. Negative if we have gone the
+        wrong way."""
+        direction = self.distance_pid_heading + self.odometry.heading
+        return ((self.odometry.x - self._origin[0]) * math.cos(direction) +
+                (self.odometry.y - self._origin[1]) * math.sin(direction))
 
     def drive(self, vX, vY, vZ, absolute=False):
-        motor_vectors = {}
-        for name, params in Chassis.module_params.items():
-            motor_vectors[name] = {'x': vX + vZ * params['vz']['x'],
-                                   'y': vY + vZ * params['vz']['y']
-                                   }
-        # convert the vectors to polar coordinates
-        polar_vectors = {}
-        max_mag = 1.0
-        for name, motor_vector in motor_vectors.items():
-            polar_vectors[name] = {'dir': math.atan2(motor_vector['y'],
-                                                     motor_vector['x']
-                                                     ),
-                                   'mag': math.sqrt(motor_vector['x'] ** 2
-                                                    + motor_vector['y'] ** 2
-                                                    )
-                                   }
-            if abs(polar_vectors[name]['mag']) > max_mag:
-                max_mag = polar_vectors[name]['mag']
-
-        for name in polar_vectors.keys():
-            polar_vectors[name]['mag'] /= max_mag
-            if absolute:
-                polar_vectors[name]['mag'] = None
-                continue
-
-        for name, polar_vector in polar_vectors.items():
-            self._modules[name].steer(polar_vector['dir'], polar_vector['mag'])
+        for name, direction, speed in self.kinematics.solve(vX, vY, vZ, absolute):
+            self._modules[name].steer(direction, speed)
+
+    def update_position(self, timestamp, heading):
+        """Update the odometry from the modules and the heading"""
+        self.odometry.update(timestamp, heading,
+                             [(module.signed_distance / module.drive_counts_per_metre,
+                               module.measured_direction)
+                              for module in self._modules.values()])
+
+    def vision_displacement(self):
+        """Sideways distance to the vision target in metres. The vision
+        measurement is from when the frame was captured, so take off how
+        far we have moved and turned since then."""
+        y = self.vision.pidGet() * self.vision_scale_factor
+        capture_time = self.vision.capture_time
+        if (capture_time is None or not len(self.position_history) or
+                not len(self.bno055.history)):
+            return y
+        then = self.position_history.at(capture_time)
+        now = self.position_history.latest()
+        heading_then = self.bno055.getHeadingAt(capture_time)
+        turned = constrain_angle(self.bno055.history.latest() - heading_then)
+        # How far we have moved since the capture, relative to the robot then
+        _, dy = field_orient(now[0] - then[0], now[1] - then[1], heading_then)
+        # The target is range_finder metres in front of us
+        _, y = field_orient(self.range_finder.pidGet(), y - dy, turned)
+        return y
 
     def execute(self):
+        now = Timer.getFPGATimestamp()
+        heading = self.bno055.updateHistory(now)
+        self.update_position(now, heading)
+
         if self.field_oriented and self.inputs[3] is not None:
-            self.inputs[0:2] = field_orient(self.inputs[0], self.inputs[1], self.bno055.getHeading())
+            self.inputs[0:2] = field_orient(self.inputs[0], self.inputs[1], heading)
 
         # Are we in setpoint displacement mode?
         if self.distance_pid.isEnable():
-            if self.distance_pid.onTarget():
+            feedforward = 0.0
+            if self.profile is not None:
+                # Drive at the profile's speed, with the distance PID
+                # correcting for how far we are from where it says
+                elapsed = now - self.profile_start
+                setpoint, velocity = self.profile.sample(elapsed)
+                self.distance_pid.setSetpoint(setpoint)
+                feedforward = velocity / self.max_speed
+                if elapsed >= self.profile.duration:
+                    self.profile = None
+            elif self.distance_pid.onTarget():
                 if self.pid_counter > 10:
                     self.reset_distance_pid = False
                     # Let's see if we need to move further
@@ -226,7 +271,7 @@ class Chassis:
                         self.logger.info("X: " + str(x))
                     if self.track_vision and not self.on_vision_target():
                         self.logger.info("Tracking Vision")
-                        y = self.vision.pidGet() * self.vision_scale_factor
+                        y = self.vision_displacement()
                         if y > 0.5:
                             y = 0.5
                         elif y < -0.5:
@@ -236,7 +281,8 @@ class Chassis:
                         self.track_vision = False
                     self.distance_pid.disable()
                     self.zero_encoders()
-                    self.distance_pid_heading = constrain_angle(math.atan2(y, x)+self.bno055.getAngle())
+                    # Relative to the robot, like field_displace and distance
+                    self.distance_pid_heading = math.atan2(y, x)
                     self.distance_pid.setSetpoint(math.sqrt(x**2+y**2))
                     self.distance_pid.reset()
                     self.distance_pid.enable()
@@ -245,8 +291,9 @@ class Chassis:
                     self.pid_counter += 1
 
             # Keep driving
-            self.vx = math.cos(self.distance_pid_heading) * self.distance_pid_output.output
-            self.vy = math.sin(self.distance_pid_heading) * self.distance_pid_output.output
+            output = self.distance_pid_output.output + feedforward
+            self.vx = math.cos(self.distance_pid_heading) * output
+            self.vy = math.sin(self.distance_pid_heading) * output
         else:
             self.vx = self.inputs[0] * self.inputs[3]  # multiply by throttle
             self.vy = self.inputs[1] * self.inputs[3]  # multiply by throttle
@@ -268,12 +315,9 @@ class Chassis:
         self.logger.info("Vision: %s Rangefinder: %s Distance: %s Setpoint: %s" % (self.vision.pidGet(), self.range_finder.pidGet(), self.distance, self.distance_pid.getSetpoint()))
 
         if self.lock_wheels:
-            for _, params, module in zip(Chassis.module_params.items(),
-                                         self._modules):
-                direction = constrain_angle(math.atan2(params['vz']['y'],
-                                                       params['vz']['x']) +
-                                            math.pi / 2.0)
-                module.steer(direction, 0.0)
+            for name, direction in self.kinematics.lock_directions:
+                # With no speed the module steers without driving
+                self._modules[name].steer(direction)
         else:
             self.drive(self.vx, self.vy, self.vz)
 
@@ -287,8 +331,9 @@ class Chassis:
         return abs(self.range_finder.pidGet() - self.range_setpoint) < self.distance_pid_abs_error * 2.0
 
     def on_vision_target(self):
-        return (self.vision.no_vision_counter == 0.0 and
-                abs(self.vision.pidGet() * self.vision_scale_factor) < self.distance_pid_abs_error * 2.0)
+        # The vision filter coasts through a frame or two without the target
+        return (self.vision.confidence() > self.vision_min_confidence and
+                abs(self.vision_displacement()) < self.distance_pid_abs_error * 2.0)
 
 
 class SwerveModule():
@@ -297,11 +342,10 @@ class SwerveModule():
                  reverse_steer=False, zero_reading=0,
                  drive_encoder=False, reverse_drive_encoder=False):
         # Initialise private motor controllers
-        self._drive = CANTalon(drive)
+        self._drive = CachedCANTalon(drive)
         self.reverse_drive = reverse_drive
-        self._steer = CANTalon(steer)
+        self._steer = CachedCANTalon(steer)
         self.drive_encoder = drive_encoder
-        self._distance_offset = 0  # Offset the drive distance counts
 
         # Set up the motor controllers
         # Different depending on whether we are using absolute encoders or not
@@ -340,7 +384,7 @@ class SwerveModule():
         self._drive.setVoltageRampRate(150.0)
 
     def changeDriveControlMode(self, control_mode):
-        if self._drive.getControlMode is not control_mode:
+        if self._drive.getControlMode() != control_mode:
             if control_mode == CANTalon.ControlMode.Speed:
                 self._drive.setPID(1.0, 0.00, 0.0, 1023.0 / self.drive_max_speed)
             elif control_mode == CANTalon.ControlMode.Position:
@@ -353,6 +397,12 @@ class SwerveModule():
         setpoint = self._steer.getSetpoint()
         return float(setpoint - self._offset) / self.counts_per_radian
 
+    @property
+    def measured_direction(self):
+        # Read where the module is actually pointing from the encoder
+        position = self._steer.getPosition()
+        return float(position - self._offset) / self.counts_per_radian
+
     @property
     def speed(self):
         # Read the current speed from the controller setpoint
@@ -361,11 +411,16 @@ class SwerveModule():
 
     @property
     def distance(self):
-        # Read the current position from the encoder and remove the offset
-        return self._drive.getEncPosition() - self._distance_offset
+        # Read the current position from the encoder
+        return self._drive.getEncPosition()
 
-    def zero_distance(self):
-        self._distance_offset = self._drive.getEncPosition()
+    @property
+    def signed_distance(self):
+        # steer() runs reverse_drive motors backwards, so undo that to get
+        # the distance in the direction the module is pointing
+        if self.reverse_drive:
+            return -self.distance
+        return self.distance
 
     def steer(self, direction, speed=None):
         if self.drive_encoder:
@@ -375,28 +430,29 @@ class SwerveModule():
         # Set the speed and direction of the swerve module
         # Always choose the direction that minimises movement,
         # even if this means reversing the drive motor
+        current = self.direction  # Read the setpoint once
         if speed is None:
             # Force the modules to the direction specified - don't
             # go to the closest one and reverse.
-            delta = constrain_angle(direction - self.direction)  # rescale to +/-pi
-            self._steer.set((self.direction + delta) *
+            delta = constrain_angle(direction - current)  # rescale to +/-pi
+            self._steer.set((current + delta) *
                             self.counts_per_radian + self._offset)
             self._drive.set(0.0)
             return
 
         if abs(speed) > 0.05:
             direction = constrain_angle(direction)  # rescale to +/-pi
-            current_heading = constrain_angle(self.direction)
+            current_heading = constrain_angle(current)
 
             delta = min_angular_displacement(current_heading, direction)
 
             if self.reverse_drive:
                 speed = -speed
-            if abs(constrain_angle(self.direction - direction)) < math.pi / 6.0:
+            if abs(constrain_angle(current - direction)) < math.pi / 6.0:
                 self._drive.set(speed*self.drive_max_speed)
             else:
                 self._drive.set(-speed*self.drive_max_speed)
-            self._steer.set((self.direction + delta) *
+            self._steer.set((current + delta) *
                             self.counts_per_radian + self._offset)
         else:
             self._drive.set(0.0)
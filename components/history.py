@@ -0,0 +1,49 @@
+from collections import deque
+import math
+
+
+class TimestampedHistory:
+    """The last few samples of a value along with when they were taken, so
+    we can look up what it was at some time in the recent past. Values can
+    be numbers or tuples of numbers. If angle is set, values are angles and
+    are interpolated the short way round."""
+
+    def __init__(self, size, angle=False):
+        self.angle = angle
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def append(self, timestamp, value):
+        self._samples.append((timestamp, value))
+
+    def clear(self):
+        self._samples.clear()
+
+    def latest(self):
+        return self._samples[-1][1]
+
+    def at(self, timestamp):
+        """Value at timestamp, interpolating between the samples either
+        side of it. Times outside the history get the oldest or newest
+        sample."""
+        # Most lookups are for the last few samples, so search backwards
+        newer = None
+        for sample in reversed(self._samples):
+            if sample[0] <= timestamp:
+                if newer is None:
+                    return sample[1]
+                return self._interpolate(sample, newer, timestamp)
+            newer = sample
+        return self._samples[0][1]
+
+    def _interpolate(self, older, newer, timestamp):
+        fraction = (timestamp - older[0]) / (newer[0] - older[0])
+        if isinstance(older[1], tuple):
+            return tuple(a + (b - a) * fraction for a, b in zip(older[1], newer[1]))
+        if self.angle:
+            delta = math.atan2(math.sin(newer[1] - older[1]), math.cos(newer[1] - older[1]))
+            value = older[1] + delta * fraction
+            return math.atan2(math.sin(value), math.cos(value))
+        return older[1] + (newer[1] - older[1]) * fraction
@@ -111,7 +111,7 @@ class Intake:
         self.sd.putDouble("intake_velocity", self.velocity)
 
         self.log_queue.append(self.current_deque[maxlen-1])
-        self.velocity_queue.append(self.intake_motor.get())
+        self.velocity_queue.append(self.velocity)
 
         if self.write_log:
             self.log_current()
@@ -0,0 +1,60 @@
+import functools
+import math
+
+# Limits for moves, well inside what the drive can do
+MAX_VELOCITY = 1.8  # m/s
+MAX_ACCELERATION = 2.0  # m/s^2
+
+
+class TrapezoidalProfile:
+    """Where we should be and how fast we should be going at each point of
+    a move of distance metres: speed up at max_acceleration, cruise at
+    max_velocity, and slow down again to stop right on the distance. Short
+    moves never reach max_velocity, so the profile is a triangle."""
+
+    __slots__ = ('distance', 'max_velocity', 'max_acceleration',
+                 'accel_time', 'cruise_time', 'duration', 'peak_velocity')
+
+    def __init__(self, distance, max_velocity=MAX_VELOCITY, max_acceleration=MAX_ACCELERATION):
+        self.distance = distance
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        length = abs(distance)
+        # Can we get up to full speed and back down in the distance?
+        self.peak_velocity = min(max_velocity, math.sqrt(length * max_acceleration))
+        self.accel_time = self.peak_velocity / max_acceleration
+        accel_distance = 0.5 * max_acceleration * self.accel_time ** 2
+        if self.peak_velocity > 0.0:
+            self.cruise_time = (length - 2.0 * accel_distance) / self.peak_velocity
+        else:
+            self.cruise_time = 0.0
+        self.duration = 2.0 * self.accel_time + self.cruise_time
+
+    def sample(self, t):
+        """(position, velocity) t seconds into the move"""
+        sign = 1.0 if self.distance >= 0.0 else -1.0
+        a = self.max_acceleration
+        if t <= 0.0:
+            return 0.0, 0.0
+        if t >= self.duration:
+            return self.distance, 0.0
+        if t < self.accel_time:
+            return sign * 0.5 * a * t ** 2, sign * a * t
+        accel_distance = 0.5 * a * self.accel_time ** 2
+        if t < self.accel_time + self.cruise_time:
+            return (sign * (accel_distance + self.peak_velocity * (t - self.accel_time)),
+                    sign * self.peak_velocity)
+        # Slowing down, count back from the end
+        remaining = self.duration - t
+        return sign * (abs(self.distance) - 0.5 * a * remaining ** 2), sign * a * remaining
+
+
+@functools.lru_cache(maxsize=64)
+def _profile(distance, max_velocity, max_acceleration):
+    return TrapezoidalProfile(distance, max_velocity, max_acceleration)
+
+
+def profile_for(distance, max_velocity=MAX_VELOCITY, max_acceleration=MAX_ACCELERATION):
+    """The profile for a move, made once and reused. Distances are rounded
+    to the millimetre so the same move worked out two ways still matches."""
+    return _profile(round(distance, 3), max_velocity, max_acceleration)
@@ -0,0 +1,54 @@
+import math
+
+from .history import TimestampedHistory
+
+
+class SwerveOdometry:
+    """Where the robot is on the field, worked out every loop from how far
+    each module has driven and which way it was pointing, with the heading
+    from the IMU. Only the change in the encoders since the last update is
+    used, so they never need to be zeroed and moves can be chained one
+    after another."""
+
+    def __init__(self, history_size=50):
+        # The IMU keeps the heading history
+        self.positions = TimestampedHistory(history_size)
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self._distances = None
+
+    def reset(self, x=0.0, y=0.0):
+        """Put the robot at x, y on the field. The history is from the old
+        origin, so it is thrown away."""
+        self.x = x
+        self.y = y
+        self.positions.clear()
+
+    def update(self, timestamp, heading, modules):
+        """modules is a (distance, direction) pair for each module: the total
+        distance it has driven in metres, and the direction it is pointing
+        relative to the robot. Returns the new (x, y, heading)."""
+        if self._distances is not None:
+            # Averaged over the modules the rotation cancels out, leaving
+            # how far the centre of the robot moved
+            dx = dy = 0.0
+            for (distance, direction), last in zip(modules, self._distances):
+                moved = distance - last
+                dx += moved * math.cos(direction)
+                dy += moved * math.sin(direction)
+            dx /= len(self._distances)
+            dy /= len(self._distances)
+            # We were turning while we moved, so use the heading half way
+            heading_mid = self.heading + math.atan2(math.sin(heading - self.heading),
+                                                    math.cos(heading - self.heading)) / 2.0
+            cos, sin = math.cos(heading_mid), math.sin(heading_mid)
+            self.x += dx * cos - dy * sin
+            self.y += dx * sin + dy * cos
+        self._distances = [distance for distance, _ in modules]
+        self.heading = heading
+        self.positions.append(timestamp, (self.x, self.y))
+        return self.x, self.y, self.heading
+
+    def pose(self):
+        return self.x, self.y, self.heading
@@ -0,0 +1,143 @@
+from wpilib import CANTalon
+
+
+class HardwareSnapshot:
+    """One loop's worth of CAN readings. CachedCANTalons read each value at
+    most once between calls to tick(), which the robot makes once a loop.
+    Also keeps count of the reads they answer from their cache instead of
+    asking the controller again, and of the writes they don't send because
+    nothing changed."""
+
+    def __init__(self):
+        # Bumped by tick(), so cached readings from before it are stale
+        self.generation = 0
+        self.reads = 0
+        self.saved = 0
+        self.saved_per_tick = 0
+        self._saved_at_tick = 0
+        self.writes = 0
+        self.writes_saved = 0
+        self.writes_saved_per_tick = 0
+        self._writes_saved_at_tick = 0
+
+    def tick(self):
+        """Call once a loop, so the next loop reads everything afresh.
+        Returns the reads saved since the last call, and sets
+        saved_per_tick and writes_saved_per_tick."""
+        self.generation += 1
+        self.saved_per_tick = self.saved - self._saved_at_tick
+        self._saved_at_tick = self.saved
+        self.writes_saved_per_tick = self.writes_saved - self._writes_saved_at_tick
+        self._writes_saved_at_tick = self.writes_saved
+        return self.saved_per_tick
+
+
+# Shared by all the talons that aren't given their own
+default_snapshot = HardwareSnapshot()
+
+
+class CachedCANTalon(CANTalon):
+    """A CANTalon that reads each status value from the controller at most
+    once per snapshot tick. Components read the same value several times a
+    loop (and putData reads it again), and every read goes over the CAN bus.
+    Anything that changes the controller clears the values it affects.
+
+    Writes go the other way: components set the same gains and setpoint
+    every loop, so only changes are sent on. The talon holds on to its
+    setpoint, so there's no need to keep repeating it. Motor safety is
+    still fed on every set(). CANTalon already skips mode changes to the
+    mode it is in."""
+
+    # Setpoints closer than this to the last one aren't sent
+    epsilon = 1e-4
+
+    def __init__(self, deviceNumber, *args, snapshot=None, **kwargs):
+        # The CANTalon constructor sets the controller up through our methods
+        self._cache = {}
+        self._mode = None
+        self._pid = None
+        self._setpoint = None
+        self.snapshot = default_snapshot if snapshot is None else snapshot
+        super().__init__(deviceNumber, *args, **kwargs)
+
+    def _read(self, name, read):
+        generation = self.snapshot.generation
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == generation:
+            self.snapshot.saved += 1
+            return cached[1]
+        value = read()
+        self.snapshot.reads += 1
+        self._cache[name] = (generation, value)
+        return value
+
+    def get(self):
+        return self._read('get', super().get)
+
+    def getSetpoint(self):
+        return self._read('getSetpoint', super().getSetpoint)
+
+    def getClosedLoopError(self):
+        return self._read('getClosedLoopError', super().getClosedLoopError)
+
+    def getOutputCurrent(self):
+        return self._read('getOutputCurrent', super().getOutputCurrent)
+
+    def getEncPosition(self):
+        return self._read('getEncPosition', super().getEncPosition)
+
+    def getPosition(self):
+        return self._read('getPosition', super().getPosition)
+
+    def _changed(self, changed):
+        if changed:
+            self.snapshot.writes += 1
+        else:
+            self.snapshot.writes_saved += 1
+        return changed
+
+    def set(self, outputValue, *args, **kwargs):
+        setpoint = (outputValue, args, kwargs)
+        last = self._setpoint
+        # After stopMotor() or disableControl() CANTalon.set() has to turn
+        # the controller back on, even for the same setpoint
+        if not self._changed(last is None or last[1:] != setpoint[1:] or
+                             abs(outputValue - last[0]) > self.epsilon or
+                             self.stopped or not self.controlEnabled):
+            self.feed()
+            return
+        self._setpoint = setpoint
+        # Encoder and current readings are still good, but in PercentVbus
+        # mode get() is the output we just set
+        for name in ('get', 'getSetpoint', 'getClosedLoopError'):
+            self._cache.pop(name, None)
+        super().set(outputValue, *args, **kwargs)
+
+    def changeControlMode(self, controlMode):
+        # CANTalon only sends real changes, but the setpoint has to be sent
+        # again in the new mode, and the readings mean something else
+        if controlMode != self._mode:
+            self._mode = controlMode
+            self._setpoint = None
+            self._cache.clear()
+        super().changeControlMode(controlMode)
+
+    def setPID(self, *args, **kwargs):
+        pid = (args, kwargs)
+        if not self._changed(pid != self._pid):
+            return
+        self._pid = pid
+        self._cache.pop('getClosedLoopError', None)
+        super().setPID(*args, **kwargs)
+
+    def setPosition(self, *args, **kwargs):
+        self._cache.clear()
+        super().setPosition(*args, **kwargs)
+
+    def setFeedbackDevice(self, *args, **kwargs):
+        self._cache.clear()
+        super().setFeedbackDevice(*args, **kwargs)
+
+    def reverseSensor(self, *args, **kwargs):
+        self._cache.clear()
+        super().reverseSensor(*args, **kwargs)
@@ -1,36 +1,163 @@
+import threading
+
 from networktables import NetworkTable
+from wpilib import Timer
 from wpilib.interfaces import PIDSource
 import hal
 
+from vision import record
+
+
+class AlphaBetaFilter:
+    """Constant velocity filter, for tracking a measurement that moves
+    smoothly. Unlike an exponential average it doesn't lag behind a value
+    that is changing steadily, and it can predict where the value will be
+    between measurements. Measurements more than coast_time apart start
+    the filter again."""
+
+    def __init__(self, alpha=0.5, beta=0.1, coast_time=0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.coast_time = coast_time
+        self.reset()
+
+    def reset(self):
+        self.value = 0.0
+        self.velocity = 0.0
+        self.timestamp = None
+        self.updates = 0
+
+    def update(self, measurement, timestamp):
+        if self.timestamp is None or timestamp - self.timestamp >= self.coast_time:
+            self.value = measurement
+            self.velocity = 0.0
+            self.timestamp = timestamp
+            self.updates = 1
+            return self.value
+        dt = timestamp - self.timestamp
+        if dt <= 0.0:
+            # Capture times are estimates, so can come out a little out of
+            # order. Just blend the measurement in.
+            self.value += self.alpha * (measurement - self.value)
+            self.updates += 1
+            return self.value
+        predicted = self.value + self.velocity * dt
+        residual = measurement - predicted
+        self.value = predicted + self.alpha * residual
+        self.velocity += self.beta * residual / dt
+        self.timestamp = timestamp
+        self.updates += 1
+        return self.value
+
+    def predict(self, timestamp):
+        """Where the value will be at timestamp. We don't trust the velocity
+        for longer than coast_time."""
+        if self.timestamp is None:
+            return self.value
+        dt = min(max(timestamp - self.timestamp, 0.0), self.coast_time)
+        return self.value + self.velocity * dt
+
+    def confidence(self, timestamp):
+        """From 0 to 1. Falls off as the last measurement gets older, and is
+        low until the filter has seen a few measurements."""
+        if self.timestamp is None:
+            return 0.0
+        age = max(0.0, 1.0 - (timestamp - self.timestamp) / self.coast_time)
+        return age * min(1.0, self.updates / 3.0)
+
 
 class Vision:
-    def __init__(self):
+    # How fast the clock offset estimate is allowed to grow, in seconds per
+    # record, so it follows drift between the clocks
+    offset_creep = 0.0001
+    # A record slower than this means the vision clock has been reset
+    max_transport_delay = 0.5  # seconds
+
+    def __init__(self, udp_port=None):
         # mjpg-streamer isn't setting parameters properly yet, so do it here
         if not hal.HALIsSimulation():  # pragma: no cover
-            from vision.vision import setCaptureParameters
+            from vision.camera_settings import setCaptureParameters
             setCaptureParameters("/dev/v4l/by-id/usb-046d_0825_96EBCE50-video-index0",
                                  "/etc/default/mjpg-streamer")
         self.nt = NetworkTable.getTable('vision')
-        self._values = {'x': 0.0, 'y': 0.0, 'w': 0.0, 'h': 0.0, 'time': 0.0}
-        self._smoothed_pidget = 0.0
+        self._values = dict.fromkeys(record.FIELDS, 0.0)
+        self._values['seq'] = 0
+        self.filter = AlphaBetaFilter()
         self.no_vision_counter = 0
+        self.missed_frames = 0
+        self.stale_records = 0
+        # When the latest frame with the target in it was captured, in FPGA
+        # time. pidGet() is the target position at this time.
+        self.capture_time = None
+        # Our clock minus the vision process's, less the quickest a record
+        # has got here. Over UDP on the roboRIO that is well under a
+        # millisecond, so capture_time covers the time in the vision
+        # pipeline and the time on the wire after that.
+        self.clock_offset = None
+        # How much longer than the quickest record the latest one took
+        self.transport_delay = 0.0
+        # Records can come from NetworkTables and UDP at the same time
+        self._lock = threading.Lock()
         self.nt.addTableListener(self.valueChanged)
+        # UDP gets records to us sooner, with NetworkTables as the fallback
+        self.receiver = None
+        if udp_port is not None:
+            self.receiver = record.RecordReceiver(self.update, udp_port).start()
 
     def valueChanged(self, table, key, value, isNew):
-        self._values[key] = float(value)
-        if key == 'time':
-            # The time key is updated last,
-            # so let's update our smoothed average
-            alpha = 0.3
-            if self._values['w'] > 0.0:
-                self._smoothed_pidget = (alpha * self._values['x'] +
-                                         (1.0 - alpha) * self._smoothed_pidget)
+        if key != record.KEY:
+            return
+        # The whole frame comes in one record
+        values = record.unpack(value)
+        if values is not None:
+            self.update(values)
+
+    def update(self, values):
+        with self._lock:
+            last = self._values
+            if values['seq'] <= last['seq'] and values['time'] <= last['time']:
+                # A duplicate, or overtaken by a newer record. A lower seq
+                # with a newer time means the vision process restarted.
+                self.stale_records += 1
+                return
+            if values['seq'] > last['seq']:
+                self.missed_frames += values['seq'] - last['seq'] - 1
+            self._values = values
+            self._updateOffset(values)
+            if values['w'] > 0.0:
+                self.capture_time = values['time'] + self.clock_offset
+                self.filter.update(values['x'], self.capture_time)
                 self.no_vision_counter = 0
             else:
+                # The filter coasts until the target comes back
                 self.no_vision_counter += 1
 
+    def _updateOffset(self, values):
+        # Our clock isn't the vision process's, so line them up using the
+        # records that got here quickest
+        offset = Timer.getFPGATimestamp() - (values['time'] + values['latency'])
+        if (self.clock_offset is None or offset < self.clock_offset or
+                offset - self.clock_offset > self.max_transport_delay):
+            self.clock_offset = offset
+        else:
+            self.clock_offset = min(offset, self.clock_offset + self.offset_creep)
+        self.transport_delay = offset - self.clock_offset
+
+    def predict(self, timestamp=None):
+        """Where we expect the target to be at timestamp (now by default),
+        from how it has been moving"""
+        if timestamp is None:
+            timestamp = Timer.getFPGATimestamp()
+        return -self.filter.predict(timestamp)
+
+    def confidence(self, timestamp=None):
+        """How much we trust the target position, from 0 to 1"""
+        if timestamp is None:
+            timestamp = Timer.getFPGATimestamp()
+        return self.filter.confidence(timestamp)
+
     def getPIDSourceType(self):  # pragma: no cover
         return PIDSource.PIDSourceType.kDisplacement
 
     def pidGet(self):
-        return -self._smoothed_pidget
+        return -self.filter.value
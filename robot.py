@@ -12,6 +12,8 @@ from components import shooter
 from components.intake import Intake
 from components.defeater import Defeater
 from components.boulder_automation import BoulderAutomation
+from components.snapshot import CachedCANTalon, default_snapshot
+from vision import record
 
 from networktables import NetworkTable
 
@@ -29,17 +31,18 @@ class StrongholdRobot(magicbot.MagicRobot):
     def createObjects(self):
         self.logger = logging.getLogger("robot")
         self.sd = NetworkTable.getTable('SmartDashboard')
-        self.intake_motor = wpilib.CANTalon(14)
-        self.feeder_motor = wpilib.CANTalon(5)
-        self.shooter_motor = wpilib.CANTalon(12)
-        self.defeater_motor = wpilib.CANTalon(1)
+        self.intake_motor = CachedCANTalon(14)
+        self.feeder_motor = CachedCANTalon(5)
+        self.shooter_motor = CachedCANTalon(12)
+        self.defeater_motor = CachedCANTalon(1)
         self.joystick = wpilib.Joystick(0)
         self.gamepad = wpilib.Joystick(1)
         self.pressed_buttons_js = set()
         self.pressed_buttons_gp = set()
         # needs to be created here so we can pass it in to the PIDController
         self.bno055 = BNO055()
-        self.vision = Vision()
+        # Only listen for vision results over UDP on the real robot
+        self.vision = Vision(udp_port=None if self.isSimulation() else record.PORT)
         self.heading_hold_pid_output = BlankPIDOutput()
         Tu = 1.6
         Ku = 0.6
@@ -65,6 +68,7 @@ class StrongholdRobot(magicbot.MagicRobot):
         self.sd.putDouble("range_finder", self.range_finder.pidGet())
         self.sd.putDouble("gyro", self.bno055.getHeading())
         self.sd.putDouble("vision_pid_get", self.vision.pidGet())
+        self.sd.putDouble("vision_confidence", self.vision.confidence())
         self.sd.putDouble("vision_x", self.vision._values['x'])
         self.sd.putDouble("vision_w", self.vision._values['w'])
         self.sd.putDouble("vision_h", self.vision._values['h'])
@@ -91,11 +95,15 @@ class StrongholdRobot(magicbot.MagicRobot):
         self.sd.putDouble("joystick_throttle", self.joystick.getThrottle())
         self.sd.putDouble("range_pid_get", self.range_finder.pidGet())
         self.sd.putDouble("encoder_distance", self.chassis.distance)
+        self.sd.putDouble("odometry_x", self.chassis.odometry.x)
+        self.sd.putDouble("odometry_y", self.chassis.odometry.y)
         distances = []
         for module in self.chassis._modules.values():
             distances.append(abs(module.distance) / module.drive_counts_per_metre)
         for key, distance in zip(self.chassis._modules.keys(), distances):
             self.sd.putDouble("encoder_motor_" + key, distance)
+        self.sd.putDouble("can_reads_saved", default_snapshot.saved_per_tick)
+        self.sd.putDouble("can_writes_saved", default_snapshot.writes_saved_per_tick)
 
     def disabledInit(self):
         self.boulder_automation.done()
@@ -103,6 +111,13 @@ class StrongholdRobot(magicbot.MagicRobot):
     def disabledPeriodic(self):
         """This function is called periodically when disabled."""
         self.putData()
+        default_snapshot.tick()
+
+    def _execute_components(self):
+        # The last thing in every autonomous and teleop loop, so the next
+        # loop starts with fresh CAN readings
+        super()._execute_components()
+        default_snapshot.tick()
 
     def teleopInit(self):
         self.boulder_automation.done()
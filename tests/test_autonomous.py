@@ -43,6 +43,7 @@ def test_autonomous_state_machine(control):
     a.boulder_automation = MagicMock()
     a.boulder_automation.shoot_boulder = MagicMock()
     a.chassis.distance_pid.onTarget = MagicMock(return_value=False)
+    a.chassis.on_displace_target = MagicMock(return_value=False)
     a.chassis.heading_hold_pid.onTarget = MagicMock(return_value=False)
     a.chassis.on_range_target = MagicMock(return_value=False)
     a.chassis.on_vision_target = MagicMock(return_value=False)
@@ -59,6 +60,7 @@ def test_autonomous_state_machine(control):
         elif step == 3:
             assert a.current_state == "breach_defence"
             a.chassis.distance_pid.onTarget = MagicMock(return_value=True)
+            a.chassis.on_displace_target = MagicMock(return_value=True)
         elif step == 4:
             assert a.chassis.heading_hold_pid.setSetpoint.called
             assert a.defeater_motor.set.callled
@@ -70,9 +72,11 @@ def test_autonomous_state_machine(control):
             a.chassis.field_displace.assert_called_with(dx, dy)
             assert a.current_state == "strafing"
             a.chassis.distance_pid.onTarget = MagicMock(return_value=False)
+            a.chassis.on_displace_target = MagicMock(return_value=False)
         elif step == 7:
             assert a.current_state == "strafing"
             a.chassis.distance_pid.onTarget = MagicMock(return_value=True)
+            a.chassis.on_displace_target = MagicMock(return_value=True)
         elif step == 8:
             assert a.current_state == "range_finding"
             assert a.chassis.distance_pid.setOutputRange.called
@@ -0,0 +1,28 @@
+import unittest
+
+try:
+    from vision import benchmark
+
+    def test_benchmark():
+        results = benchmark.benchmark(iterations=5, sample_dir='sample_img')
+        assert set(results['scenarios']) == set(['sample_img', 'synthetic_320x240',
+                                                 'synthetic_640x480', 'synthetic_1280x720'])
+        for name, result in results['scenarios'].items():
+            assert result['frames'] == 5
+            assert result['fps'] > 0.0
+            latency = result['latency_ms']
+            assert latency['p50'] <= latency['p95'] <= latency['p99']
+            assert set(result['stages_ms']) == set(benchmark.STAGES)
+        assert results['scenarios']['synthetic_640x480']['resolution'] == [640, 480]
+
+    def test_synthetic_frames_have_target():
+        from vision import vision
+        for width, height in benchmark.RESOLUTIONS:
+            for image in benchmark.syntheticFrames(width, height, count=3):
+                assert image.shape == (height, width, 3)
+                assert vision.TargetFinder().detect(image).found
+
+except ImportError as e:
+    @unittest.skip('Missing dependency - ' + str(e))
+    def test_fail():
+        pass
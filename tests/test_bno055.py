@@ -20,3 +20,15 @@ def test_reset_heading():
     bno055.resetHeading(2.0)
     heading = bno055.getHeading()
     assert heading == 2.0
+
+def test_heading_history():
+    bno055 = BNO055()
+    bno055.resetHeading(0.0)
+    assert bno055.getHeadingAt(1.0) == 0.0
+    assert bno055.updateHistory(1.0) == 0.0
+    bno055.offset -= 0.2
+    assert abs(bno055.updateHistory(2.0) - 0.2) < epsilon
+    assert abs(bno055.getHeadingAt(1.5) - 0.1) < epsilon
+    # Resetting the heading throws the history away
+    bno055.resetHeading(1.0)
+    assert len(bno055.history) == 0
@@ -0,0 +1,77 @@
+import os
+import struct
+import tempfile
+
+from vision import camera_settings
+
+CONFIG = '''# A comment with --device %(device)s -br 1
+INPUT[1]="input_opencv.so -ex 5 -br 20 --filter cvfilter_py.so --device %(link)s"
+INPUT[2]="input_opencv.so -co 30 --device /dev/some-other-camera"
+'''
+
+
+def fake_camera():
+    """A device file, a link to it, and a config that uses the link"""
+    directory = tempfile.mkdtemp()
+    device = os.path.join(directory, 'video0')
+    open(device, 'w').close()
+    link = os.path.join(directory, 'camera')
+    os.symlink(device, link)
+    config = os.path.join(directory, 'mjpg-streamer')
+    with open(config, 'w') as f:
+        f.write(CONFIG % {'device': device, 'link': link})
+    return device, config
+
+
+def test_parse_config():
+    device, config = fake_camera()
+    settings = camera_settings.parseConfig(config, device)
+    # Found through the link, in the order they need setting
+    assert settings.controls == [('exposure_auto', 1), ('exposure_absolute', 5),
+                                 ('brightness', 20)]
+    # Parsed once until the file changes
+    assert camera_settings.parseConfig(config, device) is settings
+    with open(config, 'a') as f:
+        f.write('INPUT[3]="input_opencv.so -sa 40 --device %s"\n' % device)
+    stat = os.stat(config)
+    os.utime(config, (stat.st_atime, stat.st_mtime + 10))
+    settings = camera_settings.parseConfig(config, device)
+    assert settings.controls[-1] == ('saturation', 40)
+
+
+def test_apply_settings():
+    device, config = fake_camera()
+    calls = []
+
+    def ioctl(fd, request, arg):
+        calls.append((request,) + struct.unpack('<Ii', arg))
+
+    timings = camera_settings.setCaptureParameters(device, config, ioctl)
+    assert calls == [(camera_settings.VIDIOC_S_CTRL, 0x009a0901, 1),
+                     (camera_settings.VIDIOC_S_CTRL, 0x009a0902, 5),
+                     (camera_settings.VIDIOC_S_CTRL, 0x00980900, 20)]
+    assert [name for name, value, seconds, error in timings] == ['exposure_auto', 'exposure_absolute',
+                                                                 'brightness']
+    for name, value, seconds, error in timings:
+        assert seconds >= 0.0
+        assert error is None
+
+
+def test_apply_errors():
+    device, config = fake_camera()
+    # A plain file isn't a video device, so every control fails, but we
+    # still try them all
+    timings = camera_settings.setCaptureParameters(device, config)
+    assert len(timings) == 3
+    for name, value, seconds, error in timings:
+        assert isinstance(error, OSError)
+
+
+def test_missing_device():
+    device, config = fake_camera()
+    try:
+        camera_settings.setCaptureParameters(device + '-missing', config)
+    except Exception as e:
+        assert 'No such video device' in str(e)
+    else:
+        assert False
@@ -172,3 +172,81 @@ def test_field_orient_calc():
     assert abs(vy - 0.0) < epsilon
 
 
+
+def test_vision_displacement():
+    from components.history import TimestampedHistory
+    chassis = Chassis()
+    chassis.vision = MagicMock()
+    chassis.vision.pidGet = MagicMock(return_value=0.5)
+    chassis.vision.capture_time = None
+    chassis.range_finder = MagicMock()
+    chassis.range_finder.pidGet = MagicMock(return_value=2.0)
+    chassis.bno055 = MagicMock()
+    chassis.bno055.history = TimestampedHistory(10, angle=True)
+    chassis.bno055.getHeadingAt = chassis.bno055.history.at
+    y = 0.5 * chassis.vision_scale_factor
+    # Nothing to correct with yet
+    assert chassis.vision_displacement() == y
+    chassis.vision.capture_time = 1.0
+    for timestamp in [1.0, 1.1]:
+        chassis.bno055.history.append(timestamp, 0.0)
+        chassis.position_history.append(timestamp, (0.0, 0.0))
+    # We haven't moved since the frame was captured
+    assert abs(chassis.vision_displacement() - y) < epsilon
+    # We have since turned towards the target
+    chassis.bno055.history.append(1.2, 0.05)
+    chassis.position_history.append(1.2, (0.0, 0.0))
+    assert abs(chassis.vision_displacement() - (y * math.cos(0.05) - 2.0 * math.sin(0.05))) < epsilon
+    # And moved sideways towards it
+    chassis.bno055.history.append(1.3, 0.0)
+    chassis.position_history.append(1.3, (0.0, 0.1))
+    assert abs(chassis.vision_displacement() - (y - 0.1)) < epsilon
+
+def test_distance_from_odometry():
+    chassis = Chassis()
+    chassis.distance_pid_heading = math.pi / 2.0
+    chassis.odometry.update(0.0, 0.0, [(0.0, 0.0)] * 4)
+    chassis.zero_encoders()
+    chassis.odometry.update(0.1, 0.0, [(0.5, math.pi / 2.0)] * 4)
+    assert abs(chassis.distance - 0.5) < epsilon
+    # Moves can be chained without the encoders being reset
+    chassis.zero_encoders()
+    assert abs(chassis.distance) < epsilon
+    # Sideways doesn't count, and going backwards is negative
+    chassis.odometry.update(0.2, 0.0, [(1.0, 0.0)] * 4)
+    chassis.odometry.update(0.3, 0.0, [(0.8, 0.0)] * 4)
+    assert abs(chassis.distance) < epsilon
+    chassis.odometry.update(0.4, 0.0, [(0.6, math.pi / 2.0)] * 4)
+    assert abs(chassis.distance + 0.2) < epsilon
+
+def test_odometry_reverse_drive():
+    chassis = Chassis()
+    # The modules are a mix of reverse_drive and not
+    assert len(set(module.reverse_drive for module in chassis._modules.values())) == 2
+    counts = [0.0]
+    for module in chassis._modules.values():
+        # Pointing straight ahead, with the encoder counting the way the
+        # motor is driven
+        module._steer.getPosition = MagicMock(return_value=module._offset)
+        sign = -1.0 if module.reverse_drive else 1.0
+        module._drive.getEncPosition = (lambda module=module, sign=sign:
+                                        sign * counts[0] * module.drive_counts_per_metre)
+    chassis.update_position(0.0, 0.0)
+    counts[0] = 1.0
+    chassis.update_position(0.1, 0.0)
+    assert abs(chassis.odometry.x - 1.0) < epsilon
+    assert abs(chassis.odometry.y) < epsilon
+
+def test_field_displace_profile():
+    from components.motion_profile import profile_for
+    chassis = Chassis()
+    chassis.bno055 = MagicMock()
+    chassis.bno055.getHeading = MagicMock(return_value=0.0)
+    chassis.distance_pid = MagicMock()
+    chassis.distance_pid.onTarget = MagicMock(return_value=True)
+    chassis.field_displace(0.6, 0.8)
+    assert chassis.profile is profile_for(1.0)
+    # Not done until the profile has been followed
+    assert not chassis.on_displace_target()
+    chassis.zero_encoders()
+    assert chassis.on_displace_target()
@@ -0,0 +1,46 @@
+import math
+
+from components.history import TimestampedHistory
+
+epsilon = 0.0001
+
+
+def test_interpolation():
+    history = TimestampedHistory(10)
+    history.append(1.0, 0.0)
+    history.append(2.0, 10.0)
+    history.append(3.0, 20.0)
+    assert history.at(2.0) == 10.0
+    assert abs(history.at(2.25) - 12.5) < epsilon
+    # Outside of the history we get the oldest or newest sample
+    assert history.at(0.0) == 0.0
+    assert history.at(5.0) == 20.0
+    assert history.latest() == 20.0
+
+
+def test_tuples():
+    history = TimestampedHistory(10)
+    history.append(1.0, (0.0, 1.0))
+    history.append(2.0, (1.0, 3.0))
+    x, y = history.at(1.5)
+    assert abs(x - 0.5) < epsilon
+    assert abs(y - 2.0) < epsilon
+
+
+def test_angles():
+    history = TimestampedHistory(10, angle=True)
+    history.append(1.0, math.pi - 0.1)
+    history.append(2.0, -math.pi + 0.1)
+    # Goes the short way round, through pi rather than through zero
+    assert abs(abs(history.at(1.5)) - math.pi) < epsilon
+
+
+def test_size():
+    history = TimestampedHistory(3)
+    for i in range(10):
+        history.append(float(i), float(i))
+    assert len(history) == 3
+    # The old samples are gone
+    assert history.at(0.0) == 7.0
+    history.clear()
+    assert len(history) == 0
@@ -0,0 +1,60 @@
+import math
+import random
+
+from components.kinematics import SwerveKinematics
+
+length = 498.0
+width = 600.0
+motor_dist = math.sqrt((width / 2) ** 2 + (length / 2) ** 2)
+vz_x = (width / 2) / motor_dist
+vz_y = (length / 2) / motor_dist
+module_params = {'a': {'vz': {'x': -vz_x, 'y': vz_y}},
+                 'b': {'vz': {'x': -vz_x, 'y': -vz_y}},
+                 'c': {'vz': {'x': vz_x, 'y': -vz_y}},
+                 'd': {'vz': {'x': vz_x, 'y': vz_y}}}
+
+
+def reference_drive(vX, vY, vZ, absolute=False):
+    """The dict based calculation Chassis.drive used to do"""
+    polar_vectors = {}
+    max_mag = 1.0
+    for name, params in module_params.items():
+        x = vX + vZ * params['vz']['x']
+        y = vY + vZ * params['vz']['y']
+        polar_vectors[name] = {'dir': math.atan2(y, x), 'mag': math.sqrt(x ** 2 + y ** 2)}
+        if abs(polar_vectors[name]['mag']) > max_mag:
+            max_mag = polar_vectors[name]['mag']
+    for name in polar_vectors.keys():
+        polar_vectors[name]['mag'] /= max_mag
+        if absolute:
+            polar_vectors[name]['mag'] = None
+    return [(name, vector['dir'], vector['mag']) for name, vector in polar_vectors.items()]
+
+
+def test_matches_drive():
+    kinematics = SwerveKinematics(module_params)
+    rand = random.Random(0)
+    commands = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 1.0), (-1.0, 1.0, -1.0)]
+    commands += [tuple(rand.uniform(-1.0, 1.0) for _ in range(3)) for _ in range(200)]
+    for vx, vy, vz in commands:
+        for absolute in (False, True):
+            # Exactly the same, not just close
+            assert (kinematics.solve(vx, vy, vz, absolute) ==
+                    reference_drive(vx, vy, vz, absolute))
+    assert kinematics.solve_batch(commands) == [reference_drive(*command) for command in commands]
+
+
+def test_normalised():
+    kinematics = SwerveKinematics(module_params)
+    speeds = [speed for _, _, speed in kinematics.solve(1.0, 1.0, 1.0)]
+    assert max(speeds) == 1.0
+    speeds = [speed for _, _, speed in kinematics.solve(0.1, 0.2, 0.0)]
+    assert all(abs(speed - math.sqrt(0.05)) < 1e-9 for speed in speeds)
+
+
+def test_lock_directions():
+    kinematics = SwerveKinematics(module_params)
+    for name, direction in kinematics.lock_directions:
+        vz = module_params[name]['vz']
+        # At right angles to the line to the centre of the robot
+        assert abs(math.cos(direction) * vz['x'] + math.sin(direction) * vz['y']) < 1e-9
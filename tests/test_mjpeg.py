@@ -0,0 +1,112 @@
+import unittest
+import threading
+import http.server
+
+try:
+    from vision import mjpeg
+    import cv2
+    import numpy as np
+
+    def jpeg_frames(count, width=320, height=240):
+        frames = []
+        for i in range(count):
+            image = np.zeros((height, width, 3), np.uint8)
+            cv2.rectangle(image, (100 + i * 10, 80), (139 + i * 10, 109), (0, 255, 0), -1)
+            frames.append(cv2.imencode('.jpg', image)[1].tobytes())
+        return frames
+
+    def fake_server(frames, content_length=True):
+        """Serve the JPEG frames the way mjpg-streamer does"""
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace;boundary=boundarydonotcross')
+                self.end_headers()
+                for i, frame in enumerate(frames):
+                    self.wfile.write(b'--boundarydonotcross\r\nContent-Type: image/jpeg\r\n')
+                    if content_length:
+                        self.wfile.write(b'Content-Length: %d\r\n' % len(frame))
+                    self.wfile.write(b'X-Timestamp: %d.500000\r\n\r\n' % (1000 + i))
+                    self.wfile.write(frame)
+                    self.wfile.write(b'\r\n')
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.daemon = True
+        thread.start()
+        return server, 'http://127.0.0.1:%d/?action=stream' % server.server_address[1]
+
+    def test_read_stream():
+        server, url = fake_server(jpeg_frames(3))
+        cap = mjpeg.MJPEGCapture(url)
+        for i in range(3):
+            retval, image = cap.read()
+            assert retval
+            assert image.shape == (240, 320, 3)
+            assert cap.timestamp == 1000.5 + i
+        assert cap.read() == (False, None)
+        assert not cap.isOpened()
+        assert cap.frames == 3
+        server.server_close()
+
+    def test_reduced_decode():
+        for reduce in [2, 4]:
+            server, url = fake_server(jpeg_frames(2))
+            cap = mjpeg.MJPEGCapture(url, reduce)
+            retval, image = cap.read()
+            assert image.shape == (240 // reduce, 320 // reduce, 3)
+            # Straight into a buffer, like the ring buffer does
+            buf = np.zeros_like(image)
+            retval, image = cap.read(buf)
+            assert retval
+            assert image is buf
+            assert buf.any()
+            cap.release()
+            server.server_close()
+
+    def test_reduced_fallback():
+        server, url = fake_server(jpeg_frames(3))
+        cap = mjpeg.MJPEGCapture(url, 2)
+        # What OpenCV before 3.4.10 does with the reduced flags
+        cap.flags = cv2.IMREAD_COLOR
+        retval, image = cap.read()
+        assert image.shape == (120, 160, 3)
+        assert cap.decoder_reduces is False
+        buf = np.zeros_like(image)
+        retval, image = cap.read(buf)
+        assert image is buf
+        assert buf.any()
+        cap.release()
+        server.server_close()
+        # Whatever this OpenCV does, the frames come out reduced
+        server, url = fake_server(jpeg_frames(2))
+        cap = mjpeg.MJPEGCapture(url, 2)
+        assert cap.read()[1].shape == (120, 160, 3)
+        assert cap.decoder_reduces in (True, False)
+        assert cap.read()[1].shape == (120, 160, 3)
+        cap.release()
+        server.server_close()
+
+    def test_no_content_length():
+        server, url = fake_server(jpeg_frames(2), content_length=False)
+        cap = mjpeg.MJPEGCapture(url, 2)
+        assert cap.read()[0]
+        assert cap.read()[0]
+        assert not cap.read()[0]
+        server.server_close()
+
+    def test_bad_reduce():
+        try:
+            mjpeg.MJPEGCapture('http://127.0.0.1:1/', 3)
+        except ValueError:
+            pass
+        else:
+            assert False
+
+except ImportError as e:
+    @unittest.skip('Missing dependency - ' + str(e))
+    def test_fail():
+        pass
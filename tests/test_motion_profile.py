@@ -0,0 +1,56 @@
+from components.motion_profile import TrapezoidalProfile, profile_for
+
+epsilon = 0.0001
+
+
+def check_profile(profile, dt=0.02):
+    """Steps through the profile checking it never breaks its limits, and
+    that integrating the velocity gets us to where it says"""
+    position = 0.0
+    last_velocity = 0.0
+    t = 0.0
+    while t < profile.duration + dt:
+        setpoint, velocity = profile.sample(t)
+        assert abs(velocity) <= profile.max_velocity + epsilon
+        assert abs(velocity - last_velocity) <= profile.max_acceleration * dt + epsilon
+        assert abs(setpoint - position) < 0.05
+        position += velocity * dt
+        last_velocity = velocity
+        t += dt
+    assert profile.sample(profile.duration) == (profile.distance, 0.0)
+    assert abs(position - profile.distance) < 0.05
+
+
+def test_trapezoid():
+    profile = TrapezoidalProfile(4.1, 1.8, 2.0)
+    assert profile.peak_velocity == 1.8
+    assert profile.cruise_time > 0.0
+    # Quicker than going at the top speed the old PID allowed, without
+    # having to creep up on the end
+    assert profile.duration < 4.1 / (0.55 * 3.4) + 1.0
+    check_profile(profile)
+
+
+def test_triangle():
+    profile = TrapezoidalProfile(0.5, 1.8, 2.0)
+    assert profile.peak_velocity < 1.8
+    assert abs(profile.cruise_time) < epsilon
+    check_profile(profile)
+
+
+def test_backwards():
+    profile = TrapezoidalProfile(-1.0, 1.8, 2.0)
+    assert profile.sample(profile.duration / 2.0)[1] < 0.0
+    check_profile(profile)
+
+
+def test_nothing_to_do():
+    profile = TrapezoidalProfile(0.0)
+    assert profile.duration == 0.0
+    assert profile.sample(0.5) == (0.0, 0.0)
+
+
+def test_profiles_cached():
+    # The same move worked out slightly differently gets the same profile
+    assert profile_for(3.3) is profile_for(3.3 + 1e-9)
+    assert profile_for(3.3) is not profile_for(3.4)
@@ -0,0 +1,61 @@
+import math
+
+from components.odometry import SwerveOdometry
+
+epsilon = 0.0001
+
+
+def modules(distance, direction, turn=0.0):
+    """All four modules driven the same way, plus turn metres around the
+    centre of the robot"""
+    corners = [math.pi / 4.0, 3.0 * math.pi / 4.0, -3.0 * math.pi / 4.0, -math.pi / 4.0]
+    result = []
+    for corner in corners:
+        x = distance * math.cos(direction) - turn * math.sin(corner)
+        y = distance * math.sin(direction) + turn * math.cos(corner)
+        result.append((math.sqrt(x ** 2 + y ** 2), math.atan2(y, x)))
+    return result
+
+
+def test_straight_lines():
+    odometry = SwerveOdometry()
+    odometry.update(0.0, 0.0, modules(0.0, 0.0))
+    assert odometry.pose() == (0.0, 0.0, 0.0)
+    odometry.update(0.1, 0.0, modules(1.0, 0.0))
+    assert abs(odometry.x - 1.0) < epsilon and abs(odometry.y) < epsilon
+    # Distances are totals, so the same reading hasn't moved us
+    odometry.update(0.2, 0.0, modules(1.0, 0.0))
+    assert abs(odometry.x - 1.0) < epsilon
+    # Facing left, driving forwards relative to the robot is +y on the field
+    odometry.update(0.3, math.pi / 2.0, modules(1.0, 0.0))
+    odometry.update(0.4, math.pi / 2.0, modules(1.5, 0.0))
+    assert abs(odometry.x - 1.0) < epsilon
+    assert abs(odometry.y - 0.5) < epsilon
+    # Backwards
+    odometry.update(0.5, math.pi / 2.0, modules(0.5, 0.0))
+    assert abs(odometry.y + 0.5) < epsilon
+
+
+def test_spinning_on_the_spot():
+    odometry = SwerveOdometry()
+    odometry.update(0.0, 0.0, modules(0.0, 0.0))
+    for i in range(1, 11):
+        odometry.update(i * 0.02, i * 0.1, modules(0.0, 0.0, turn=i * 0.05))
+    assert abs(odometry.x) < epsilon and abs(odometry.y) < epsilon
+    assert abs(odometry.heading - 1.0) < epsilon
+
+
+def test_history():
+    odometry = SwerveOdometry()
+    odometry.update(1.0, 0.0, modules(0.0, 0.0))
+    odometry.update(2.0, 0.2, modules(1.0, 0.0))
+    x, y = odometry.positions.at(1.5)
+    assert abs(x - 0.5 * odometry.x) < epsilon
+    assert abs(y - 0.5 * odometry.y) < epsilon
+    odometry.reset(3.0, 4.0)
+    assert not len(odometry.positions)
+    assert odometry.pose() == (3.0, 4.0, 0.2)
+    # Carries on from the new origin
+    odometry.update(3.0, 0.2, modules(2.0, 0.0))
+    assert abs(odometry.x - (3.0 + math.cos(0.2))) < epsilon
+    assert abs(odometry.y - (4.0 + math.sin(0.2))) < epsilon
@@ -0,0 +1,58 @@
+import time
+
+from vision import record
+from vision import latency
+
+
+class Result:
+    x, y, w, h, score = 0.25, -0.5, 0.1, 0.05, 0.9
+    capture_time = 1000.0
+
+
+def test_round_trip():
+    values = record.pack(7, Result(), 1000.04)
+    assert len(values) == len(record.FIELDS)
+    unpacked = record.unpack(tuple(values))
+    assert unpacked['seq'] == 7
+    assert unpacked['time'] == 1000.0
+    assert abs(unpacked['latency'] - 0.04) < 1e-9
+    assert (unpacked['x'], unpacked['y'], unpacked['w'], unpacked['h']) == (0.25, -0.5, 0.1, 0.05)
+    assert unpacked['score'] == 0.9
+
+
+def test_bad_records():
+    assert record.unpack(None) is None
+    assert record.unpack([1.0, 2.0]) is None
+
+
+def test_datagram():
+    values = record.pack(7, Result(), 1000.04)
+    data = record.encode(values)
+    assert len(data) == record.DATAGRAM.size
+    assert record.decode(data) == record.unpack(values)
+    assert record.decode(data[:-1]) is None
+
+
+def test_udp_loopback():
+    received = []
+    receiver = record.RecordReceiver(received.append, port=0, address='127.0.0.1').start()
+    sender = record.RecordSender('127.0.0.1', receiver.port)
+    try:
+        for seq in range(1, 4):
+            sender.send(record.pack(seq, Result(), 1000.04))
+        sender.socket.sendto(b'not a record', ('127.0.0.1', receiver.port))
+        deadline = time.time() + 2.0
+        while receiver.malformed < 1 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sender.close()
+        receiver.stop()
+    assert [values['seq'] for values in received] == [1, 2, 3]
+    assert receiver.received == 3
+    assert receiver.malformed == 1
+
+
+def test_latency_harness():
+    summary = latency.measure(count=20, rate=200.0, networktables=False)
+    assert summary['udp']['received'] == 20
+    assert summary['udp']['mean_ms'] >= 0.0
@@ -0,0 +1,47 @@
+import unittest
+import csv
+import os
+import tempfile
+
+try:
+    from vision import replay
+    from vision import benchmark
+    import cv2
+
+    def test_bounded_imap():
+        consumed = []
+
+        def source():
+            for i in range(20):
+                consumed.append(i)
+                yield i
+
+        pool = replay.multiprocessing.Pool(2)
+        try:
+            for result in replay.boundedImap(pool, abs, source(), 4):
+                # Never more than the window ahead of what we have seen
+                assert len(consumed) - result <= 4
+                assert result == len(consumed) - 4 or len(consumed) == 20
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_replay_directory():
+        frames = benchmark.syntheticFrames(320, 240, count=6)
+        directory = tempfile.mkdtemp()
+        for i, image in enumerate(frames):
+            cv2.imwrite(os.path.join(directory, 'frame%02d.png' % i), image)
+        output = os.path.join(directory, 'results.csv')
+        assert replay.replay(directory, output, workers=2) == 6
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        assert [int(row['frame']) for row in rows] == list(range(6))
+        assert [row['source'] for row in rows] == ['frame%02d.png' % i for i in range(6)]
+        for row in rows:
+            assert float(row['w']) > 0.0
+            assert float(row['process_ms']) >= 0.0
+
+except ImportError as e:
+    @unittest.skip('Missing dependency - ' + str(e))
+    def test_fail():
+        pass
@@ -0,0 +1,128 @@
+import unittest
+import multiprocessing
+
+try:
+    from vision import ringbuffer
+    import numpy as np
+
+    class FakeCapture:
+        """Fills the frame it is given with the frame number"""
+        def __init__(self, frames):
+            self.frames = frames
+            self.count = 0
+
+        def read(self, image):
+            if self.count >= self.frames:
+                return False, None
+            self.count += 1
+            image.fill(self.count % 256)
+            return True, image
+
+    def test_write_read():
+        ring = ringbuffer.FrameRingBuffer(3, (240, 320, 3))
+        assert ring.read(0, timeout=0.01) is None
+        frame = np.full((240, 320, 3), 7, np.uint8)
+        assert ring.write(frame, 1.5) == 1
+        seq, timestamp, image = ring.read(0)
+        assert seq == 1
+        assert timestamp == 1.5
+        assert (image == 7).all()
+        # A view onto the shared memory, not a copy
+        assert np.shares_memory(image, ring._frames)
+        assert ring.valid(1)
+        # Nothing newer yet
+        assert ring.read(1, timeout=0.01) is None
+
+    def test_latest_frame():
+        ring = ringbuffer.FrameRingBuffer(3, (4, 4))
+        for i in range(1, 6):
+            ring.write(np.full((4, 4), i, np.uint8), float(i))
+        # Readers always get the newest frame, skipping the ones in between
+        seq, timestamp, image = ring.read(1)
+        assert seq == 5
+        assert timestamp == 5.0
+        assert (image == 5).all()
+        # The writer has lapped the older frames
+        assert not ring.valid(1)
+        assert not ring.valid(2)
+        assert ring.valid(4)
+        assert ring.valid(5)
+
+    def test_claimed_slot_is_invalid():
+        ring = ringbuffer.FrameRingBuffer(2, (4, 4))
+        ring.write(np.zeros((4, 4), np.uint8))
+        ring.write(np.zeros((4, 4), np.uint8))
+        assert ring.valid(1)
+        # Frame 3 goes into frame 1's slot, so frame 1 is gone as soon as
+        # the writer starts on it
+        ring.claim()
+        assert not ring.valid(1)
+        assert ring.read(1, timeout=0.01)[0] == 2
+        ring.publish()
+        assert ring.read(2)[0] == 3
+
+    def test_pinned_slot():
+        ring = ringbuffer.FrameRingBuffer(3, (4, 4))
+        ring.write(np.full((4, 4), 1, np.uint8))
+        seq, timestamp, image = ring.read(0)
+        # However slow we are, the writer goes round the frame we're using
+        for i in range(2, 10):
+            ring.write(np.full((4, 4), i, np.uint8))
+        assert ring.valid(seq)
+        assert (image == 1).all()
+        ring.release(seq)
+        ring.write(np.zeros((4, 4), np.uint8))
+        ring.write(np.zeros((4, 4), np.uint8))
+        assert not ring.valid(seq)
+
+    def test_all_slots_pinned():
+        ring = ringbuffer.FrameRingBuffer(2, (4, 4))
+        ring.write(np.zeros((4, 4), np.uint8))
+        first = ring.read(0)[0]
+        ring.write(np.zeros((4, 4), np.uint8))
+        second = ring.read(first)[0]
+        # Nowhere free, so the writer has to take the older frame
+        ring.write(np.zeros((4, 4), np.uint8))
+        assert not ring.valid(first)
+        assert ring.valid(second)
+        ring.release(first)
+        ring.release(second)
+        ring.write(np.zeros((4, 4), np.uint8))
+        assert not ring.valid(second)
+
+    def test_iterator_releases():
+        ring = ringbuffer.FrameRingBuffer(3, (4, 4))
+        ring.write(np.zeros((4, 4), np.uint8))
+        for seq, timestamp, image in ring:
+            assert list(ring._pins) == [1, 0, 0]
+            break
+        assert list(ring._pins) == [0, 0, 0]
+
+    def test_capture_time():
+        ring = ringbuffer.FrameRingBuffer(3, (4, 4))
+        cap = FakeCapture(1)
+        cap.timestamp = 1234.5
+        ring.capture(cap)
+        assert ring.read(0)[1] == 1234.5
+
+    def test_capture_process():
+        ring = ringbuffer.FrameRingBuffer(4, (240, 320, 3))
+        process = multiprocessing.Process(target=ring.capture, args=(FakeCapture(50),))
+        process.start()
+        seqs = []
+        for seq, timestamp, image in ring:
+            values = np.unique(image)
+            # Only trust what we read if the slot wasn't rewritten meanwhile
+            if ring.valid(seq):
+                # The whole frame came from the same capture
+                assert list(values) == [seq % 256]
+            seqs.append(seq)
+        process.join()
+        assert ring.seq == 50
+        assert seqs[-1] == 50
+        assert seqs == sorted(set(seqs))
+
+except ImportError as e:
+    @unittest.skip('Missing dependency - ' + str(e))
+    def test_fail():
+        pass
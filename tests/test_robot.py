@@ -21,3 +21,12 @@ def test_debounce(robot, hal_data, control):
         return True
 
     control.run_test(_on_step)
+
+
+def test_snapshot_ticks_in_autonomous(robot, control):
+    from components.snapshot import default_snapshot
+    generation = default_snapshot.generation
+    control.set_autonomous(enabled=True)
+    control.run_test(lambda tm: tm < 1.0)
+    # A fresh set of CAN readings every loop
+    assert default_snapshot.generation - generation >= 40
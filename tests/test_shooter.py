@@ -21,7 +21,7 @@ def test_control_methods():
 
 def test_up_to_speed():
     shooter = Shooter()
-    shooter.shoter_motor = MagicMock()
+    shooter.shooter_motor = MagicMock()
 
     # test error condition
     shooter.shooter_motor.get = MagicMock(return_value=(Shooter.max_speed*Shooter.shoot_percentage/2.0)+1.0)
@@ -0,0 +1,75 @@
+from unittest.mock import MagicMock
+
+from components.snapshot import CachedCANTalon, HardwareSnapshot
+
+
+def test_reads_cached(wpilib, monkeypatch):
+    current = MagicMock(return_value=3.0)
+    monkeypatch.setattr(wpilib.CANTalon, 'getOutputCurrent', current)
+    counter = HardwareSnapshot()
+    talon = CachedCANTalon(0, snapshot=counter)
+    assert isinstance(talon, wpilib.CANTalon)
+
+    assert talon.getOutputCurrent() == 3.0
+    assert talon.getOutputCurrent() == 3.0
+    assert current.call_count == 1
+    assert counter.tick() == 1
+    # Read again on the next loop
+    current.return_value = 4.0
+    assert talon.getOutputCurrent() == 4.0
+    assert current.call_count == 2
+    assert counter.tick() == 0
+    assert counter.reads == 2
+
+
+def test_set_clears_setpoint(wpilib):
+    talon = CachedCANTalon(0, snapshot=HardwareSnapshot())
+    talon.set(1.0)
+    assert talon.getSetpoint() == 1.0
+    talon.set(2.0)
+    assert talon.getSetpoint() == 2.0
+
+
+def test_writes_coalesced(wpilib, monkeypatch):
+    talon = CachedCANTalon(0)
+    # Leave out whatever the constructor sends
+    talon.snapshot = counter = HardwareSnapshot()
+    for name in ('set', 'changeControlMode', 'setPID'):
+        monkeypatch.setattr(wpilib.CANTalon, name, MagicMock())
+    sent = wpilib.CANTalon.set
+    for _ in range(5):
+        talon.changeControlMode(wpilib.CANTalon.ControlMode.Speed)
+        talon.setPID(1.0, 0.0, 0.0, 0.1)
+        talon.set(100.0)
+    # CANTalon sorts out repeated modes itself
+    assert wpilib.CANTalon.changeControlMode.call_count == 5
+    assert wpilib.CANTalon.setPID.call_count == 1
+    assert sent.call_count == 1
+    # Small changes in the setpoint aren't worth sending
+    talon.set(100.0 + talon.epsilon / 2.0)
+    assert sent.call_count == 1
+    talon.set(101.0)
+    assert sent.call_count == 2
+    # A new mode needs its setpoint sent, even if it is the same number
+    talon.changeControlMode(wpilib.CANTalon.ControlMode.Position)
+    talon.set(101.0)
+    assert sent.call_count == 3
+    assert counter.writes_saved == 9
+    counter.tick()
+    assert counter.writes_saved_per_tick == 9
+
+
+def test_unchanged_set_keeps_motor_safety(wpilib, monkeypatch):
+    talon = CachedCANTalon(0, snapshot=HardwareSnapshot())
+    feed = MagicMock()
+    monkeypatch.setattr(wpilib.CANTalon, 'feed', feed)
+    talon.set(0.5)
+    talon.set(0.5)
+    assert feed.call_count == 2
+    assert talon.snapshot.writes_saved == 1
+    # Stopping the motor means the same setpoint has to turn it back on
+    talon.stopMotor()
+    assert not talon.controlEnabled
+    talon.set(0.5)
+    assert talon.controlEnabled
+    assert not talon.stopped
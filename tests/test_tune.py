@@ -0,0 +1,61 @@
+import unittest
+import os
+import tempfile
+
+try:
+    from vision import tune
+    import cv2
+    import numpy as np
+
+    def labelled_frames(directory):
+        """Frames with a green target, a bigger yellow-green patch that loose
+        bounds pick up instead and a small blue-green speck. Returns the
+        label CSV filename."""
+        rows = []
+        for i, (cx, cy) in enumerate([(80, 60), (200, 150), (160, 120), (240, 80)]):
+            image = np.zeros((240, 320, 3), np.uint8)
+            cv2.rectangle(image, (cx - 20, cy - 15), (cx + 19, cy + 14), (90, 220, 40), -1)
+            px, py = (cx + 120) % 260, (cy + 100) % 200
+            cv2.rectangle(image, (px, py), (px + 59, py + 39), (40, 220, 140), -1)
+            # A small blue-green speck that is never the largest blob
+            cv2.rectangle(image, (10, 200), (19, 209), (220, 200, 40), -1)
+            filename = 'frame%d.png' % i
+            cv2.imwrite(os.path.join(directory, filename), image)
+            rows.append('%s,%f,%f,%f,%f' % (filename, cx / 160.0 - 1.0, cy / 120.0 - 1.0,
+                                            40.0 / 320, 30.0 / 240))
+        # And one without a target at all
+        cv2.imwrite(os.path.join(directory, 'empty.png'), np.zeros((240, 320, 3), np.uint8))
+        rows.append('empty.png,0,0,0,0')
+        labels = os.path.join(directory, 'labels.csv')
+        with open(labels, 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+        return labels
+
+    def test_load_labels():
+        labels = tune.loadLabels([labelled_frames(tempfile.mkdtemp())])
+        assert len(labels) == 5
+        filename, label = labels[-1]
+        assert os.path.exists(filename)
+        assert label == [0.0, 0.0, 0.0, 0.0]
+
+    def test_tune():
+        labels = tune.loadLabels([labelled_frames(tempfile.mkdtemp())])
+        best = tune.tune(labels, workers=2)
+        assert best['accuracy'] == 1.0
+        assert best['images'] == 5
+        # The target's hue is 68, the patch next to it 43
+        assert 43 < best['lower_colour'][0] <= 68 <= best['upper_colour'][0]
+
+    def test_tune_prefers_fewer_pixels():
+        labels = tune.loadLabels([labelled_frames(tempfile.mkdtemp())])
+        loose = ((45, 50, 20), (100, 255, 255))
+        tight = ((65, 50, 20), (75, 255, 255))
+        best = tune.tune(labels, workers=1, candidates=[loose, tight])
+        # Both find every target, but the speck doesn't make it through the tight bounds
+        assert best['accuracy'] == 1.0
+        assert best['lower_colour'] == [65, 50, 20]
+
+except ImportError as e:
+    @unittest.skip('Missing dependency - ' + str(e))
+    def test_fail():
+        pass
@@ -1,5 +1,6 @@
 import unittest
-from networktables import NetworkTable
+from unittest.mock import MagicMock
+from networktables import NetworkTable, NumberArray
 from components.vision import Vision
 
 def find_target(filename, result, desired, deltas):
@@ -12,7 +13,9 @@ def find_target(filename, result, desired, deltas):
 try:
     from vision import vision
     import cv2
+    import numpy as np
     import csv
+    import glob
 
     def test_sample_images():
         variables = ['x', 'y', 'w', 'h']
@@ -25,6 +28,285 @@ try:
                 results = vision.findTarget(image)
                 yield find_target, sample[0], results[:-1], sample[1:], [0.05, 0.05]  # Don't send the return image
 
+    def synthetic_frame(cx, cy, w, h, width=320, height=240):
+        """A black frame with a green target centred on cx, cy"""
+        image = np.zeros((height, width, 3), np.uint8)
+        cv2.rectangle(image, (cx - w // 2, cy - h // 2),
+                      (cx + w // 2 - 1, cy + h // 2 - 1), (0, 255, 0), -1)
+        return image
+
+    def synthetic_result(cx, cy, w, h, width=320, height=240):
+        return [2.0 * cx / width - 1.0, 2.0 * cy / height - 1.0,
+                float(w) / width, float(h) / height]
+
+    def test_finder_reuses_buffers():
+        finder = vision.TargetFinder()
+        results = finder.findTarget(synthetic_frame(100, 80, 40, 30))
+        hsv, mask = finder.threshold._hsv, finder._mask
+        find_target("synthetic", results[:-1], synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+        results = finder.findTarget(synthetic_frame(200, 150, 40, 30))
+        find_target("synthetic", results[:-1], synthetic_result(200, 150, 40, 30), [0.05, 0.05])
+        # Smaller windows reuse the same buffers too
+        results = finder.findTarget(synthetic_frame(200, 150, 40, 30), (150, 100, 250, 200))
+        find_target("synthetic", results[:-1], synthetic_result(200, 150, 40, 30), [0.05, 0.05])
+        assert finder.threshold._hsv is hsv
+        assert finder._mask is mask
+
+    def test_lookup_threshold():
+        hsv = vision.HSVThreshold()
+        lookup = vision.LookupThreshold(bits=7)
+        # With 7 bits the sample images give exactly the same mask
+        for filename in glob.glob('sample_img/*.png'):
+            image = cv2.imread(filename)
+            hsv_mask = np.empty(image.shape[:2], np.uint8)
+            lookup_mask = np.empty(image.shape[:2], np.uint8)
+            hsv.threshold(hsv.convert(image), hsv_mask)
+            lookup.threshold(lookup.convert(image), lookup_mask)
+            assert np.array_equal(hsv_mask, lookup_mask), filename
+            assert (vision.TargetFinder(lookup).findTarget(image.copy())[:-1] ==
+                    vision.findTarget(image.copy())[:-1])
+        # Quantised tables still find the synthetic target
+        finder = vision.TargetFinder(vision.LookupThreshold(bits=5))
+        results = finder.findTarget(synthetic_frame(100, 80, 40, 30))
+        find_target("synthetic", results[:-1], synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+        # Changing the bounds rebuilds the table
+        finder.threshold.setBounds([0, 0, 0], [10, 255, 255])
+        assert finder.findTarget(synthetic_frame(100, 80, 40, 30))[2] == 0.0
+        try:
+            vision.LookupThreshold(bits=8)
+        except ValueError:
+            pass
+        else:
+            assert False, "8 bit table should be too big"
+
+    def test_pyramid_finder():
+        for scale in [0.5, 0.25]:
+            finder = vision.PyramidFinder(scale)
+            for filename in glob.glob('sample_img/*.png'):
+                image = cv2.imread(filename)
+                results = finder.findTarget(image.copy())
+                expected = vision.findTarget(image.copy())
+                # The refinement is done at full resolution, so should match
+                assert np.allclose(results[:-1], expected[:-1]), filename
+            results = finder.findTarget(synthetic_frame(100, 80, 40, 30))
+            find_target("synthetic", results[:-1], synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+            assert finder.findTarget(np.zeros((240, 320, 3), np.uint8))[2] == 0.0
+
+    def test_headless_detect():
+        image = synthetic_frame(100, 80, 40, 30)
+        original = image.copy()
+        result = vision.TargetFinder().detect(image, timestamp=1234.0)
+        # Detection never draws on the frame
+        assert np.array_equal(image, original)
+        assert result.found
+        assert result.capture_time == 1234.0
+        assert result.process_time >= result.capture_time
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+        # Rendering is a separate step
+        vision.render(image, result)
+        assert not np.array_equal(image, original)
+        missing = vision.TargetFinder().detect(np.zeros((240, 320, 3), np.uint8))
+        assert not missing.found
+        assert missing.rect is None
+
+    def test_candidates():
+        image = synthetic_frame(200, 150, 40, 30)
+        # A long thin strip and a speck of noise shouldn't beat the target
+        cv2.rectangle(image, (20, 20), (119, 24), (0, 255, 0), -1)
+        cv2.rectangle(image, (300, 10), (302, 12), (0, 255, 0), -1)
+        finder = vision.TargetFinder()
+        candidates = finder.findCandidates(image)
+        assert len(candidates) == 2  # The speck is too small to count
+        assert candidates[0].score > candidates[1].score
+        best = candidates[0]
+        find_target("synthetic", [best.x, best.y, best.w, best.h],
+                    synthetic_result(200, 150, 40, 30), [0.05, 0.05])
+        assert best.bounds == (180, 135, 40, 30)
+        assert best.area == 40 * 30
+        assert len(finder.findCandidates(image, count=1)) == 1
+        assert finder.findCandidates(np.zeros((240, 320, 3), np.uint8)) == []
+
+    def test_scored_detect():
+        image = synthetic_frame(200, 150, 40, 30)
+        # A bigger but badly shaped strip that the largest blob would pick
+        cv2.rectangle(image, (20, 20), (219, 29), (0, 255, 0), -1)
+        largest = vision.TargetFinder().detect(image)
+        assert largest.score == 1.0
+        assert largest.w > 0.5
+        finder = vision.TargetFinder(scored=True)
+        result = finder.detect(image)
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(200, 150, 40, 30), [0.05, 0.05])
+        assert result.score == finder.findCandidates(image, count=1)[0].score
+        assert 0.0 < result.score < 1.0
+        # The region of interest still works
+        result = finder.detect(image, roi=(150, 100, 260, 220))
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(200, 150, 40, 30), [0.05, 0.05])
+        assert not finder.detect(np.zeros((240, 320, 3), np.uint8)).found
+
+    def test_tracker():
+        with open('sample_img/tests.csv', 'r') as csvfile:
+            testreader = csv.reader(csvfile, delimiter=',')
+            for sample in testreader:
+                tracker = vision.TargetTracker()
+                image = cv2.imread('sample_img/' + sample[0])
+                tracker.findTarget(image.copy())
+                # The second frame should only search around the first detection
+                results = tracker.findTarget(image.copy())
+                if float(sample[3]) > 0.0:
+                    assert tracker.roi_scans == 1
+                    assert tracker.full_scans == 1
+                find_target(sample[0], results[:-1], sample[1:], [0.05, 0.05])
+
+    def test_tracker_sample_images():
+        for filename in sorted(glob.glob('sample_img/*.png')):
+            image = cv2.imread(filename)
+            expected = vision.findTarget(image.copy())
+            assert expected[2] > 0.0, filename
+            tracker = vision.TargetTracker()
+            tracker.findTarget(image.copy())
+            # The second frame should only search around the first
+            # detection, and find the same thing as a full scan
+            results = tracker.findTarget(image.copy())
+            assert tracker.roi_scans == 1
+            assert tracker.full_scans == 1
+            find_target(filename, results[:-1], expected[:-1], [0.01, 0.01])
+
+    def test_frame_budget():
+        budget = vision.FrameBudget(0.01, settle=3)
+        assert budget.mode == 'track'
+        # Relative cost of each mode, so we can fake the load
+        costs = [1.0, 0.4, 0.15, 0.15]
+
+        def run(load, frames):
+            for _ in range(frames):
+                budget.record(load * costs[budget.level])
+
+        # Track costs a little more than the budget, so drop to half
+        # resolution and stay there
+        run(0.012, 100)
+        assert budget.mode == 'half'
+        assert budget.changes == 1
+        # Much busier, so go all the way down to skipping frames
+        run(0.2, 100)
+        assert budget.mode == 'skip'
+        results = [budget.detect(synthetic_frame(100, 80, 40, 30)) for _ in range(4)]
+        assert results.count(None) == 2
+        assert budget.skipped == 2
+        result = [result for result in results if result is not None][0]
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+        # And back up again once the load goes away
+        run(0.001, 100)
+        assert budget.mode == 'track'
+
+    def test_frame_budget_pyramid():
+        # With --scale the budget is given a PyramidFinder
+        budget = vision.FrameBudget(0.01, vision.PyramidFinder(0.5), settle=3)
+        for _ in range(100):
+            budget.record(1.0)
+        assert budget.mode == 'skip'
+        results = [budget.detect(synthetic_frame(100, 80, 40, 30)) for _ in range(2)]
+        result = [result for result in results if result is not None][0]
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(100, 80, 40, 30), [0.05, 0.05])
+
+    def test_init_filter(monkeypatch):
+        monkeypatch.setattr(vision, 'NetworkTable', MagicMock())
+        monkeypatch.delenv('VISION_UDP', raising=False)
+        ntw = vision.init_filter().__self__
+        # The robot code is listening on the same roboRIO
+        assert ntw.sender.address == ('127.0.0.1', vision.record.PORT)
+        ntw.sender.close()
+        monkeypatch.setenv('VISION_UDP', '')
+        assert vision.init_filter().__self__.sender is None
+
+    def test_motion_gate():
+        gate = vision.MotionGate(max_skip=5)
+        still = synthetic_frame(100, 80, 40, 30)
+        first = gate.detect(still, None, 1.0)
+        # A little sensor noise doesn't count as the scene changing
+        noise = np.random.RandomState(0).randint(0, 3, still.shape).astype(np.uint8)
+        result = gate.detect(cv2.add(still, noise), None, 2.0)
+        assert (gate.processed, gate.skipped) == (1, 1)
+        assert result is not first
+        assert result.capture_time == 2.0
+        assert (result.x, result.y, result.w, result.h) == (first.x, first.y, first.w, first.h)
+        # Moving the target a couple of pixels does
+        result = gate.detect(synthetic_frame(102, 80, 40, 30), None, 3.0)
+        assert (gate.processed, gate.skipped) == (2, 1)
+        find_target("synthetic", [result.x, result.y, result.w, result.h],
+                    synthetic_result(102, 80, 40, 30), [0.01, 0.05])
+        # Even a still scene gets processed every so often
+        for _ in range(6):
+            gate.detect(synthetic_frame(102, 80, 40, 30))
+        assert (gate.processed, gate.skipped) == (3, 6)
+
+    class FakeCapture:
+        def __init__(self, frames):
+            self.frames = frames
+            self.count = 0
+
+        def read(self):
+            if self.count >= self.frames:
+                return False, None
+            self.count += 1
+            return True, self.count
+
+    def test_frame_grabber():
+        grabber = vision.FrameGrabber(FakeCapture(20)).start()
+        seqs = []
+        timestamps = []
+        for seq, timestamp, image in grabber:
+            seqs.append(seq)
+            timestamps.append(timestamp)
+            assert image == seq
+        grabber.stop()
+        assert grabber.frames == 20
+        # We always get the newest frame, so the last frame is never dropped
+        assert seqs[-1] == 20
+        assert seqs == sorted(set(seqs))
+        assert timestamps == sorted(timestamps)
+        assert len(seqs) + grabber.dropped == 20
+
+    def test_frame_grabber_capture_time():
+        cap = FakeCapture(1)
+        # Like an MJPEGCapture, which knows when mjpg-streamer captured it
+        cap.timestamp = 1234.5
+        grabber = vision.FrameGrabber(cap).start()
+        assert [timestamp for seq, timestamp, image in grabber] == [1234.5]
+        grabber.stop()
+
+    def test_worker_pool():
+        published = []
+        pool = vision.VisionWorkerPool((240, 320, 3), workers=2, publish=published.append)
+        positions = [(100, 80), (120, 90), (140, 100), (160, 110)]
+        for timestamp, (cx, cy) in enumerate(positions):
+            assert pool.submit(synthetic_frame(cx, cy, 40, 30), float(timestamp))
+        pool.close()
+        assert pool.published + pool.stale == len(positions)
+        # Results are only ever published in capture order
+        timestamps = [result.capture_time for result in published]
+        assert timestamps == sorted(timestamps)
+        for result in published:
+            cx, cy = positions[int(result.capture_time)]
+            find_target("synthetic", [result.x, result.y, result.w, result.h],
+                        synthetic_result(cx, cy, 40, 30), [0.05, 0.05])
+
+    def test_worker_pool_finder():
+        # The workers use the finder they are given, here one looking for red
+        published = []
+        finder = vision.TargetFinder(vision.HSVThreshold([0, 100, 100], [10, 255, 255]))
+        pool = vision.VisionWorkerPool((240, 320, 3), workers=2, publish=published.append,
+                                       finder=finder)
+        for timestamp in range(3):
+            assert pool.submit(synthetic_frame(100, 80, 40, 30), float(timestamp))
+        pool.close()
+        assert published
+        assert not any(result.found for result in published)
+
 except ImportError as e:
     @unittest.skip('Missing dependency - ' + str(e))
     def test_fail():
@@ -34,15 +316,98 @@ except ImportError as e:
 def test_nt_update():
     v = Vision()
     nt = NetworkTable.getTable('vision')
+    # Other keys are ignored
     nt.putNumber('x', 0.5)
+    assert v._values['x'] == 0.0
+    # seq, time, latency, x, y, w, h, score
+    nt.putValue('target', NumberArray.from_list([1, 1234, 0.05, 0.5, 0.1, 0.0, 0.0, 0.0]))
     assert v._values['x'] == 0.5
-    # Only updates to time should update the averaged values
-    assert v.pidGet() == 0.0
-    nt.putNumber('time', 1234)
     # No change if width is zero
     assert v.pidGet() == 0.0
     assert v.no_vision_counter == 1
-    nt.putNumber('w', 0.7)
-    nt.putNumber('time', 1235)
+    nt.putValue('target', NumberArray.from_list([3, 1235, 0.05, 0.5, 0.1, 0.7, 0.2, 1.0]))
+    assert v._values['seq'] == 3
     assert v.pidGet() != 0.0
     assert v.no_vision_counter == 0
+    assert v.missed_frames == 1
+    # Records older than the last one are dropped
+    pidget = v.pidGet()
+    nt.putValue('target', NumberArray.from_list([2, 1234.5, 0.05, -0.5, 0.1, 0.7, 0.2, 1.0]))
+    assert v._values['seq'] == 3
+    assert v.pidGet() == pidget
+    # As are ones we can't read
+    nt.putValue('target', NumberArray.from_list([4, 1236]))
+    assert v._values['seq'] == 3
+
+
+def test_udp_update():
+    from vision import record
+    import time
+    v = Vision(udp_port=0)
+    sender = record.RecordSender('127.0.0.1', v.receiver.port)
+    try:
+        sender.send([5, 2000, 0.01, 0.5, 0.1, 0.7, 0.2, 1.0])
+        deadline = time.time() + 2.0
+        while v._values['seq'] != 5 and time.time() < deadline:
+            time.sleep(0.01)
+        assert v._values['seq'] == 5
+        assert v.pidGet() != 0.0
+        # The same record turning up again over NetworkTables is ignored,
+        # as are older ones
+        v.valueChanged(None, 'target', (5, 2000, 0.01, 0.5, 0.1, 0.7, 0.2, 1.0), True)
+        v.update(record.unpack([4, 1999, 0.01, -0.5, 0.1, 0.7, 0.2, 1.0]))
+        assert v.stale_records == 2
+        assert v._values['x'] == 0.5
+        # A restarted vision process starts counting again
+        v.update(record.unpack([1, 2001, 0.01, -0.5, 0.1, 0.7, 0.2, 1.0]))
+        assert v._values['seq'] == 1
+    finally:
+        sender.close()
+        v.receiver.stop()
+
+
+def test_transport_delay(monkeypatch):
+    from components import vision as vision_component
+    from vision import record
+    now = [100.0]
+    monkeypatch.setattr(vision_component.Timer, 'getFPGATimestamp', staticmethod(lambda: now[0]))
+    v = Vision()
+    # The vision clock reads 1000.0 when ours reads 100.0, and the first
+    # record gets here straight away
+    v.update(record.unpack([1, 999.95, 0.05, 0.5, 0.1, 0.7, 0.2, 1.0]))
+    assert abs(v.capture_time - 99.95) < 1e-6
+    assert v.transport_delay == 0.0
+    # The next spends 30ms on the way, which its latency doesn't include
+    now[0] = 100.063
+    v.update(record.unpack([2, 999.983, 0.05, 0.5, 0.1, 0.7, 0.2, 1.0]))
+    assert abs(v.capture_time - 99.983) < 0.001
+    assert abs(v.transport_delay - 0.03) < 0.001
+    # The vision clock being set back starts again
+    now[0] = 101.0
+    v.update(record.unpack([3, 5.0, 0.05, 0.5, 0.1, 0.7, 0.2, 1.0]))
+    assert abs(v.capture_time - 100.95) < 1e-6
+
+
+def test_alpha_beta_filter():
+    from components.vision import AlphaBetaFilter
+    f = AlphaBetaFilter()
+    assert f.confidence(0.0) == 0.0
+    # A target sliding steadily across the frame at 30fps
+    for i in range(30):
+        t = i / 30.0
+        f.update(0.5 * t, t)
+    # Picks up the velocity, so doesn't lag behind like an average would
+    assert abs(f.value - 0.5 * t) < 0.01
+    assert abs(f.velocity - 0.5) < 0.05
+    assert abs(f.predict(t + 0.1) - 0.5 * (t + 0.1)) < 0.01
+    assert f.confidence(t) == 1.0
+    # Coasts through a short dropout, with less confidence
+    assert 0.0 < f.confidence(t + 0.2) < 1.0
+    # But not forever
+    assert f.confidence(t + f.coast_time) == 0.0
+    assert f.predict(t + 10.0) == f.predict(t + f.coast_time)
+    # After a long gap it starts again
+    f.update(-0.2, t + 1.0)
+    assert f.value == -0.2
+    assert f.velocity == 0.0
+    assert f.confidence(t + 1.0) < 0.5
@@ -0,0 +1,165 @@
+"""Measure how fast we can find the target.
+
+Runs the detector over the sample images and over generated frames at a
+few resolutions, and reports frames per second, latency percentiles and
+the time spent in each stage. Run from the top of the repository:
+
+    python3 -m vision.benchmark --output bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from vision.vision import TargetFinder, LookupThreshold, PyramidFinder
+
+STAGES = ['convert', 'threshold', 'contours', 'fitting']
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+
+
+def syntheticFrames(width, height, count=10, seed=4774):
+    """Noisy frames with a green target somewhere in each of them"""
+    random = np.random.RandomState(seed)
+    # Keep the target about the same fraction of the frame as on the robot
+    target_w = max(width // 8, 4)
+    target_h = max(height // 10, 4)
+    frames = []
+    for _ in range(count):
+        # Dim grey noise, like the low exposure frames we get on the robot
+        grey = random.randint(0, 60, (height, width, 1))
+        jitter = random.randint(0, 8, (height, width, 3))
+        image = (grey + jitter).astype(np.uint8)
+        x = random.randint(0, width - target_w)
+        y = random.randint(0, height - target_h)
+        cv2.rectangle(image, (x, y), (x + target_w - 1, y + target_h - 1),
+                      (90, 220, 40), -1)
+        frames.append(image)
+    return frames
+
+
+def sampleFrames(directory):
+    return [cv2.imread(filename)
+            for filename in sorted(glob.glob(os.path.join(directory, '*.png')))]
+
+
+class StageTimer:
+    """Times the stages of a TargetFinder by wrapping its methods, so the
+    finder itself doesn't need any timing code."""
+
+    def __init__(self, finder):
+        self.current = dict.fromkeys(STAGES + ['findContours'], 0.0)
+        finder.threshold.convert = self._wrap('convert', finder.threshold.convert)
+        finder.threshold.threshold = self._wrap('threshold', finder.threshold.threshold)
+        finder.findContours = self._wrap('findContours', finder.findContours)
+
+    def _wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.current[stage] += time.perf_counter() - start
+        return timed
+
+    def reset(self):
+        for stage in self.current:
+            self.current[stage] = 0.0
+
+    def stages(self, total):
+        """Split the total time for a frame into its stages"""
+        thresholding = self.current['convert'] + self.current['threshold']
+        return {'convert': self.current['convert'],
+                'threshold': self.current['threshold'],
+                'contours': self.current['findContours'] - thresholding,
+                'fitting': total - self.current['findContours']}
+
+
+def run(detector, frames, iterations, timer=None):
+    """Run the detector over the frames and summarise the timings"""
+    latencies = []
+    stages = dict((stage, []) for stage in STAGES)
+    # Warm up, so the buffers are allocated before we start timing
+    for image in frames:
+        detector.detect(image)
+    start = time.perf_counter()
+    for i in range(iterations):
+        image = frames[i % len(frames)]
+        if timer is not None:
+            timer.reset()
+        frame_start = time.perf_counter()
+        detector.detect(image)
+        latency = time.perf_counter() - frame_start
+        latencies.append(latency)
+        if timer is not None:
+            for stage, duration in timer.stages(latency).items():
+                stages[stage].append(duration)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000.0
+    result = {'frames': iterations,
+              'fps': iterations / elapsed,
+              'latency_ms': {'mean': float(latencies.mean()),
+                             'p50': float(np.percentile(latencies, 50)),
+                             'p95': float(np.percentile(latencies, 95)),
+                             'p99': float(np.percentile(latencies, 99))}}
+    if timer is not None:
+        result['stages_ms'] = dict((stage, float(np.mean(durations)) * 1000.0)
+                                   for stage, durations in stages.items())
+    return result
+
+
+def benchmark(iterations=200, lookup=None, scale=None,
+              sample_dir=os.path.join('tests', 'sample_img')):
+    threshold = None
+    if lookup:
+        threshold = LookupThreshold(bits=lookup)
+    finder = TargetFinder(threshold)
+    timer = StageTimer(finder)
+    detector = finder
+    if scale:
+        # The stage times then cover both the coarse and fine passes
+        detector = PyramidFinder(scale, finder=finder)
+    scenarios = []
+    samples = sampleFrames(sample_dir)
+    if samples:
+        scenarios.append(('sample_img', samples))
+    for width, height in RESOLUTIONS:
+        scenarios.append(('synthetic_%dx%d' % (width, height),
+                          syntheticFrames(width, height)))
+    results = {'time': time.time(),
+               'opencv': cv2.__version__,
+               'lookup': lookup,
+               'scale': scale,
+               'iterations': iterations,
+               'scenarios': {}}
+    for name, frames in scenarios:
+        result = run(detector, frames, iterations, timer)
+        result['resolution'] = [frames[0].shape[1], frames[0].shape[0]]
+        results['scenarios'][name] = result
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the vision processing.')
+    parser.add_argument('--iterations', help='frames to process in each scenario',
+                        type=int, default=200)
+    parser.add_argument('--lookup', help='threshold through a colour lookup table quantised to this many bits (1-7), not always faster, measure it',
+                        type=int, default=None)
+    parser.add_argument('--scale', help='search a downscaled frame first, then refine at full resolution',
+                        type=float, default=None)
+    parser.add_argument('--output', help='write the results to this JSON file', type=str, default=None)
+    args = parser.parse_args()
+
+    results = benchmark(args.iterations, args.lookup, args.scale)
+    for name, result in sorted(results['scenarios'].items()):
+        print("%-24s %8.1f fps  p50 %6.2fms  p95 %6.2fms  p99 %6.2fms" %
+              (name, result['fps'], result['latency_ms']['p50'],
+               result['latency_ms']['p95'], result['latency_ms']['p99']))
+        print("%-24s " % "" + "  ".join("%s %.2fms" % (stage, result['stages_ms'][stage])
+                                         for stage in STAGES))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,113 @@
+"""Set the camera controls straight through V4L2.
+
+The settings come from the mjpg-streamer config, so sample images and the
+robot use the same ones as the stream. The config is only parsed again if
+it changes, and the controls are all set through one open file with
+ioctl rather than by running v4l2-ctl. This module only uses the standard
+library, so the robot code can import it without pulling in OpenCV.
+"""
+import collections
+import fcntl
+import logging
+import os
+import re
+import struct
+import time
+
+# VIDIOC_S_CTRL takes a struct v4l2_control { __u32 id; __s32 value; }
+VIDIOC_S_CTRL = 0xC008561C
+_CONTROL = struct.Struct('<Ii')
+
+CONTROL_IDS = {'brightness': 0x00980900,
+               'contrast': 0x00980901,
+               'saturation': 0x00980902,
+               'exposure_auto': 0x009a0901,
+               'exposure_absolute': 0x009a0902}
+EXPOSURE_MANUAL = 1
+
+# mjpg-streamer input_opencv options, and the controls they set
+OPTIONS = collections.OrderedDict([('-ex', 'exposure_absolute'),
+                                   ('-br', 'brightness'),
+                                   ('-co', 'contrast'),
+                                   ('-sa', 'saturation')])
+_DEVICE = re.compile('--device ([^ \t\n\r\f\v"\']+)')
+_OPTION = re.compile('(%s) ([0-9]+)' % '|'.join(OPTIONS))
+
+logger = logging.getLogger("vision")
+
+
+class CameraSettings:
+    """The controls to set on a device, as (name, value) pairs in the order
+    they need setting"""
+
+    __slots__ = ('device', 'controls')
+
+    def __init__(self, device, controls=None):
+        self.device = device
+        self.controls = controls or []
+
+    def __repr__(self):
+        return "CameraSettings(%r, %r)" % (self.device, self.controls)
+
+
+# Parsed settings, keyed by (config file, modification time, device)
+_cache = {}
+
+
+def parseConfig(config_file, device):
+    """Find the settings for device in an mjpg-streamer config file. The
+    result is cached until the file changes."""
+    root_device = os.path.realpath(device)
+    key = (config_file, os.stat(config_file).st_mtime, root_device)
+    if key in _cache:
+        return _cache[key]
+    controls = []
+    with open(config_file) as f:
+        for line in f:
+            if line.lstrip().startswith('#'):
+                continue
+            match = _DEVICE.search(line)
+            # Follow symlinks to see if they point at the same device
+            if match is None or os.path.realpath(match.group(1)) != root_device:
+                continue
+            options = dict(_OPTION.findall(line))
+            for option, name in OPTIONS.items():
+                if option in options:
+                    if name == 'exposure_absolute':
+                        # Exposure only sticks with auto exposure off
+                        controls.append(('exposure_auto', EXPOSURE_MANUAL))
+                    controls.append((name, int(options[option])))
+    settings = CameraSettings(device, controls)
+    _cache[key] = settings
+    return settings
+
+
+def applySettings(settings, ioctl=fcntl.ioctl):
+    """Set all the controls through one open file. Returns (name, value,
+    seconds, error) for each control, where error is None if it worked."""
+    timings = []
+    fd = os.open(settings.device, os.O_RDWR)
+    try:
+        for name, value in settings.controls:
+            start = time.perf_counter()
+            error = None
+            try:
+                ioctl(fd, VIDIOC_S_CTRL, _CONTROL.pack(CONTROL_IDS[name], value))
+            except OSError as e:
+                error = e
+            elapsed = time.perf_counter() - start
+            timings.append((name, value, elapsed, error))
+            if error is None:
+                logger.info("Set %s to %d in %.1fms" % (name, value, elapsed * 1000.0))
+            else:
+                logger.warning("Could not set %s to %d: %s" % (name, value, error))
+    finally:
+        os.close(fd)
+    return timings
+
+
+def setCaptureParameters(device, mjpg_config_file='mjpg-streamer', ioctl=fcntl.ioctl):
+    """Set the controls on device to the ones in the mjpg-streamer config"""
+    if not os.path.exists(device):
+        raise Exception("No such video device: %s" % device)
+    return applySettings(parseConfig(mjpg_config_file, device), ioctl)
@@ -0,0 +1,118 @@
+"""Compare how long vision records take to arrive over UDP and NetworkTables.
+
+Runs a stand-in vision process that sends made up records over both
+transports to this process on the loopback interface, and reports how
+long after sending each one turned up. Run from the top of the
+repository:
+
+    python3 -m vision.latency --count 200 --rate 30
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+
+from vision import record
+
+
+class FakeResult:
+    """Enough of a TargetResult for record.pack()"""
+
+    def __init__(self, capture_time):
+        self.x, self.y, self.w, self.h, self.score = 0.1, -0.2, 0.15, 0.1, 1.0
+        self.capture_time = capture_time
+
+
+class LatencyRecorder:
+    """Callback for a transport, noting when each record arrives"""
+
+    def __init__(self):
+        self.latencies = {}
+
+    def __call__(self, values):
+        # The record was sent latency seconds after the frame was captured
+        sent = values['time'] + values['latency']
+        self.latencies.setdefault(values['seq'], time.time() - sent)
+
+    def summary(self, count):
+        latencies = sorted(latency * 1000.0 for latency in self.latencies.values())
+        if not latencies:
+            return {'received': 0}
+        return {'received': len(latencies),
+                'lost': count - len(latencies),
+                'mean_ms': sum(latencies) / len(latencies),
+                'p50_ms': latencies[len(latencies) // 2],
+                'p95_ms': latencies[int(len(latencies) * 0.95)]}
+
+
+def send(count, rate, port, networktables=True):
+    """The stand-in vision process"""
+    nt = None
+    if networktables:
+        from networktables import NetworkTable, NumberArray
+        NetworkTable.setIPAddress('127.0.0.1')
+        NetworkTable.setClientMode()
+        NetworkTable.initialize()
+        nt = NetworkTable.getTable('vision')
+        # Give the client time to connect
+        time.sleep(1.0)
+    sender = record.RecordSender('127.0.0.1', port)
+    for seq in range(1, count + 1):
+        now = time.time()
+        values = record.pack(seq, FakeResult(now), now)
+        sender.send(values)
+        if nt is not None:
+            nt.putValue(record.KEY, NumberArray.from_list(values))
+        time.sleep(1.0 / rate)
+    sender.close()
+    # Let the last NetworkTables update go out
+    time.sleep(0.5)
+
+
+def measure(count=200, rate=30.0, networktables=True):
+    """Send count records at rate per second, and summarise the latency of
+    each transport"""
+    udp = LatencyRecorder()
+    receiver = record.RecordReceiver(udp, port=0, address='127.0.0.1').start()
+    transports = {'udp': udp}
+    if networktables:
+        from networktables import NetworkTable
+        NetworkTable.setServerMode()
+        NetworkTable.initialize()
+        nt = LatencyRecorder()
+        transports['networktables'] = nt
+
+        def valueChanged(table, key, value, isNew):
+            if key == record.KEY:
+                values = record.unpack(value)
+                if values is not None:
+                    nt(values)
+        NetworkTable.getTable('vision').addTableListener(valueChanged)
+    args = (count, rate, receiver.port, networktables)
+    if networktables:
+        # Spawned, so the sender doesn't inherit our NetworkTables server.
+        # The child imports the main module again, which the robot test
+        # runner doesn't survive, so only do it when we have to.
+        sender = multiprocessing.get_context('spawn').Process(target=send, args=args)
+    else:
+        # UDP alone doesn't need a process of its own
+        sender = threading.Thread(target=send, args=args)
+    sender.start()
+    sender.join()
+    receiver.stop()
+    return dict((name, recorder.summary(count)) for name, recorder in transports.items())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure vision record latency over UDP and NetworkTables.')
+    parser.add_argument('--count', help='records to send', type=int, default=200)
+    parser.add_argument('--rate', help='records per second', type=float, default=30.0)
+    parser.add_argument('--udp-only', help="don't send over NetworkTables", action='store_true')
+    args = parser.parse_args()
+
+    for name, summary in sorted(measure(args.count, args.rate, not args.udp_only).items()):
+        if not summary['received']:
+            print("%-14s nothing received" % name)
+            continue
+        print("%-14s %4d received  mean %6.2fms  p50 %6.2fms  p95 %6.2fms" %
+              (name, summary['received'], summary['mean_ms'], summary['p50_ms'], summary['p95_ms']))
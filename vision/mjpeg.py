@@ -0,0 +1,141 @@
+"""Read frames from the mjpg-streamer HTTP stream.
+
+mjpg-streamer already has the camera open to stream it to the driver
+station, so rather than opening the camera a second time we can read the
+same JPEG frames from its HTTP output. The JPEGs are decoded straight to a
+reduced size, which is much cheaper than decoding them in full and then
+scaling them down.
+
+imdecode only honours the reduced flags from OpenCV 3.4.10. Older versions
+quietly decode in full, so the first frame is checked, and if it comes
+out full size every frame is scaled down with cv2.resize instead.
+"""
+import urllib.request
+
+import cv2
+import numpy as np
+
+# Decoding flags for each reduction factor
+REDUCED = {1: cv2.IMREAD_COLOR,
+           2: cv2.IMREAD_REDUCED_COLOR_2,
+           4: cv2.IMREAD_REDUCED_COLOR_4,
+           8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class MJPEGCapture:
+    """Reads frames from a multipart JPEG stream over HTTP. Has the same
+    read() as cv2.VideoCapture, so it can be used anywhere that is. Frames
+    are decoded at 1/reduce of their full size."""
+
+    def __init__(self, url, reduce=1, timeout=5.0):
+        if reduce not in REDUCED:
+            raise ValueError("Can only reduce frames by %s, not %s" % (sorted(REDUCED), reduce))
+        self.url = url
+        self.reduce = reduce
+        self.flags = REDUCED[reduce]
+        # Whether imdecode reduced the frame for us, None until we know
+        self.decoder_reduces = None if reduce > 1 else True
+        self.frames = 0
+        # mjpg-streamer sends the capture time of each frame, which we
+        # keep for the last frame read. FrameGrabber and FrameRingBuffer
+        # use it as the frame's capture time, so the latency in the record
+        # includes the time the frame spent in mjpg-streamer.
+        self.timestamp = None
+        self._stream = urllib.request.urlopen(url, timeout=timeout)
+        content_type = self._stream.headers.get('Content-Type', '')
+        if 'boundary=' not in content_type:
+            self._stream.close()
+            raise Exception("Not an MJPEG stream: %s" % url)
+        boundary = content_type.split('boundary=')[1].split(';')[0].strip().strip('"')
+        if boundary.startswith('--'):
+            boundary = boundary[2:]
+        self._boundary = ('--' + boundary).encode('ascii')
+
+    def isOpened(self):
+        return self._stream is not None
+
+    def release(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _readPart(self):
+        """Read the next part of the stream, returning its headers and the
+        JPEG data, or None at the end of the stream"""
+        # Skip to the boundary
+        while True:
+            line = self._stream.readline()
+            if not line:
+                return None
+            if line.strip() == self._boundary:
+                break
+            if line.strip() == self._boundary + b'--':
+                return None
+        headers = {}
+        while True:
+            line = self._stream.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            length = int(headers['content-length'])
+            data = self._stream.read(length)
+            if len(data) < length:
+                return None
+            return headers, data
+        # No length, so read up to the end of the JPEG
+        data = bytearray()
+        while True:
+            line = self._stream.readline()
+            if not line:
+                return None
+            data += line
+            end = data.find(b'\xff\xd9')
+            if end >= 0:
+                return headers, bytes(data[:end + 2])
+
+    def read(self, image=None):
+        """Returns (True, frame), or (False, None) at the end of the stream.
+        If image is given and is the right shape, the frame goes into it."""
+        if self._stream is None:
+            return False, None
+        while True:
+            part = self._readPart()
+            if part is None:
+                self.release()
+                return False, None
+            headers, data = part
+            frame = self._decode(np.frombuffer(data, np.uint8), image)
+            if frame is not None:
+                break
+            # A corrupt frame - try the next one
+        self.frames += 1
+        if 'x-timestamp' in headers:
+            self.timestamp = float(headers['x-timestamp'])
+        if image is not None and image is not frame and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def _decode(self, data, image):
+        if self.decoder_reduces:
+            return cv2.imdecode(data, self.flags)
+        full = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if full is None:
+            return None
+        height, width = full.shape[:2]
+        # libjpeg rounds the reduced size up
+        size = ((width + self.reduce - 1) // self.reduce,
+                (height + self.reduce - 1) // self.reduce)
+        if self.decoder_reduces is None:
+            frame = cv2.imdecode(data, self.flags)
+            self.decoder_reduces = frame is not None and frame.shape[:2] == (size[1], size[0])
+            if self.decoder_reduces:
+                return frame
+        if image is None or image.shape != (size[1], size[0]) + full.shape[2:]:
+            image = None
+        return cv2.resize(full, size, dst=image, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,118 @@
+"""The record the vision process publishes for each frame.
+
+Everything about a frame goes out as one number array under KEY, so the
+robot sees all of it at once instead of a key at a time. The same record
+can also be sent as a fixed size UDP datagram, which skips the batching
+NetworkTables does. This module only uses the standard library, so the
+robot code can import it too.
+"""
+import socket
+import struct
+import threading
+
+KEY = 'target'
+# time is the capture time of the frame, latency how long after capture
+# the record was sent
+FIELDS = ('seq', 'time', 'latency', 'x', 'y', 'w', 'h', 'score')
+
+# Teams are allowed to use UDP ports 5800-5810 on the field
+PORT = 5801
+DATAGRAM = struct.Struct('<Q7d')
+
+
+def pack(seq, result, now):
+    """Pack a TargetResult for frame number seq, sent at time now"""
+    return [float(seq), result.capture_time, now - result.capture_time,
+            result.x, result.y, result.w, result.h, result.score]
+
+
+def unpack(values):
+    """Turn a record back into a dict keyed by FIELDS. values can be any
+    sequence of numbers, such as the NumberArray NetworkTables gives its
+    listeners, which is updated in place, so it is copied straight away.
+    Returns None if it isn't a record we understand."""
+    if values is None or len(values) != len(FIELDS):
+        return None
+    record = dict(zip(FIELDS, (float(value) for value in values)))
+    record['seq'] = int(record['seq'])
+    return record
+
+
+def encode(values):
+    """Turn a packed record into a datagram"""
+    return DATAGRAM.pack(int(values[0]), *values[1:])
+
+
+def decode(data):
+    """Turn a datagram back into a dict like unpack()"""
+    if len(data) != DATAGRAM.size:
+        return None
+    return unpack(DATAGRAM.unpack(data))
+
+
+class RecordSender:
+    """Send records to the robot over UDP"""
+
+    def __init__(self, host, port=PORT):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, values):
+        try:
+            self.socket.sendto(encode(values), self.address)
+        except OSError:
+            # Nobody listening yet, or the network is down. NetworkTables
+            # still gets the record.
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+class RecordReceiver:
+    """Listen for records on a background thread, and hand each one to
+    callback as a dict. Datagrams that aren't records are counted and
+    dropped. Sorting out duplicate and out of order records is up to the
+    callback, as it may be getting them from NetworkTables as well."""
+
+    def __init__(self, callback, port=PORT, address=''):
+        self.callback = callback
+        self.received = 0
+        self.malformed = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((address, port))
+        # Wake up now and then to see if we have been stopped
+        self.socket.settimeout(0.5)
+        self.port = self.socket.getsockname()[1]
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="RecordReceiver")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.socket.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self.socket.recv(DATAGRAM.size + 1)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            values = decode(data)
+            if values is None:
+                self.malformed += 1
+                continue
+            self.received += 1
+            self.callback(values)
@@ -0,0 +1,123 @@
+"""Re-run the vision processing over recorded footage.
+
+Streams frames from a video file or a directory of images through the
+detector on every core, and writes the result and processing time for
+each frame to a CSV file. Only a few frames are in flight at once, so
+memory use doesn't grow with the length of the recording. Run from the
+top of the repository:
+
+    python3 -m vision.replay match.avi --output match.csv
+"""
+import argparse
+import collections
+import csv
+import glob
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from vision.vision import TargetFinder, LookupThreshold, PyramidFinder
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+FIELDS = ['frame', 'source', 'x', 'y', 'w', 'h', 'process_ms']
+
+
+def frameSource(path):
+    """Yield (frame number, source, image) for each frame in a video file
+    or a directory of images. The source is the file name for images and
+    the position in milliseconds for video."""
+    if os.path.isdir(path):
+        filenames = sorted(filename for filename in glob.glob(os.path.join(path, '*'))
+                           if filename.lower().endswith(IMAGE_EXTENSIONS))
+        for index, filename in enumerate(filenames):
+            image = cv2.imread(filename, cv2.IMREAD_COLOR)
+            if image is not None:
+                yield index, os.path.basename(filename), image
+        return
+    if not os.path.exists(path):
+        raise Exception("No such video file: %s" % path)
+    cap = cv2.VideoCapture(path)
+    index = 0
+    while True:
+        position = cap.get(cv2.CAP_PROP_POS_MSEC)
+        retval, image = cap.read()
+        if not retval:
+            break
+        yield index, "%.1f" % position, image
+        index += 1
+    cap.release()
+
+
+def boundedImap(pool, function, iterable, window):
+    """Like pool.imap, but never reads more than window items ahead of the
+    results that have been handed back. Pool.imap reads its whole input up
+    front, which would load an entire video into memory."""
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+# Each worker process gets its own detector, set up by _initWorker
+_detector = None
+
+
+def _initWorker(lookup, scale):
+    global _detector
+    threshold = None
+    if lookup:
+        threshold = LookupThreshold(bits=lookup)
+    _detector = TargetFinder(threshold)
+    if scale:
+        _detector = PyramidFinder(scale, finder=_detector)
+
+
+def _process(frame):
+    index, source, image = frame
+    start = time.perf_counter()
+    result = _detector.detect(image)
+    elapsed = time.perf_counter() - start
+    return index, source, result.x, result.y, result.w, result.h, elapsed * 1000.0
+
+
+def replay(path, output, workers=None, lookup=None, scale=None):
+    """Process every frame in path and write the results to the CSV file
+    output. Returns the number of frames processed."""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, _initWorker, (lookup, scale))
+    frames = 0
+    try:
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in boundedImap(pool, _process, frameSource(path), 2 * workers):
+                writer.writerow(row)
+                frames += 1
+    finally:
+        pool.close()
+        pool.join()
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-run vision processing over recorded footage.')
+    parser.add_argument('path', help='video file or directory of images')
+    parser.add_argument('--output', help='CSV file to write the results to', type=str, default='replay.csv')
+    parser.add_argument('--workers', help='number of processes to use, defaults to one per core',
+                        type=int, default=None)
+    parser.add_argument('--lookup', help='threshold through a colour lookup table quantised to this many bits (1-7), not always faster, measure it',
+                        type=int, default=None)
+    parser.add_argument('--scale', help='search a downscaled frame first, then refine at full resolution',
+                        type=float, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    frames = replay(args.path, args.output, args.workers, args.lookup, args.scale)
+    elapsed = time.time() - start
+    print("Processed %d frames in %.1fs (%.1f fps)" % (frames, elapsed, frames / max(elapsed, 1e-6)))
@@ -0,0 +1,172 @@
+"""Pass frames between processes through shared memory.
+
+The capture process writes each frame straight into a slot of the ring,
+and the detector works on a view of that slot, so frames are never copied
+or pickled. The writer never waits for the readers. A reader pins the
+slot it is working on and the writer goes round it, so a slow detector
+still gets to finish with its frame; with at least two slots more than
+there are readers the writer always has a free slot. If it doesn't, it
+writes over the oldest frame anyway, and the reader finds out from
+valid() and throws its result away.
+"""
+import multiprocessing
+import time
+
+import numpy as np
+
+# Slot sequence number while a frame is being written into it
+WRITING = -1
+
+
+class FrameRingBuffer:
+    """A fixed number of frame slots in shared memory, each with the
+    sequence number and timestamp of the frame in it, how many readers
+    have it pinned, and a cursor pointing at the newest complete frame.
+    One process writes, any number can read."""
+
+    def __init__(self, slots, shape):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = int(np.prod(self.shape))
+        self._pixels = multiprocessing.RawArray('B', slots * size)
+        # Not 'q', which some Pythons (3.6) say has no size
+        self._seqs = multiprocessing.RawArray('l', slots)
+        self._timestamps = multiprocessing.RawArray('d', slots)
+        self._pins = multiprocessing.RawArray('i', slots)
+        self._latest = multiprocessing.RawValue('l', 0)
+        self._latest_slot = multiprocessing.RawValue('i', slots - 1)
+        self._closed = multiprocessing.RawValue('b', 0)
+        self._condition = multiprocessing.Condition()
+        self._views()
+
+    def _views(self):
+        pixels = np.frombuffer(self._pixels, dtype=np.uint8)
+        self._frames = pixels.reshape((self.slots,) + self.shape)
+        # Only used by the writer
+        self._writing = None
+
+    def __getstate__(self):
+        # The views are rebuilt on the other side, pointing at the same memory
+        return (self.slots, self.shape, self._pixels, self._seqs, self._timestamps,
+                self._pins, self._latest, self._latest_slot, self._closed, self._condition)
+
+    def __setstate__(self, state):
+        (self.slots, self.shape, self._pixels, self._seqs, self._timestamps,
+         self._pins, self._latest, self._latest_slot, self._closed, self._condition) = state
+        self._views()
+
+    @property
+    def seq(self):
+        """Sequence number of the newest complete frame, 0 if none yet"""
+        return self._latest.value
+
+    def claim(self):
+        """Get the slot for the next frame to be written into. Readers
+        can't see it until publish() is called."""
+        with self._condition:
+            latest = self._latest_slot.value
+            # The next slot round that isn't the newest frame or pinned
+            slot = None
+            for i in range(1, self.slots):
+                candidate = (latest + i) % self.slots
+                if not self._pins[candidate]:
+                    slot = candidate
+                    break
+            if slot is None:
+                # Their frame is gone, so there's nothing left to release
+                slot = (latest + 1) % self.slots
+                self._pins[slot] = 0
+            self._seqs[slot] = WRITING
+        self._writing = slot
+        return self._frames[slot]
+
+    def publish(self, timestamp=None):
+        """Make the frame written into the claimed slot the newest one"""
+        if timestamp is None:
+            timestamp = time.time()
+        slot = self._writing
+        self._writing = None
+        with self._condition:
+            seq = self._latest.value + 1
+            self._timestamps[slot] = timestamp
+            self._seqs[slot] = seq
+            self._latest.value = seq
+            self._latest_slot.value = slot
+            self._condition.notify_all()
+        return seq
+
+    def write(self, image, timestamp=None):
+        """Copy a frame in. Capture code that can read straight into the
+        slot from claim() doesn't need the copy."""
+        np.copyto(self.claim(), image)
+        return self.publish(timestamp)
+
+    def close(self):
+        """No more frames are coming, wake up the readers"""
+        with self._condition:
+            self._closed.value = 1
+            self._condition.notify_all()
+
+    def read(self, last_seq=0, timeout=None):
+        """Wait for a frame newer than last_seq. Returns (seq, timestamp,
+        image), where image is a view onto the slot, or None if the ring
+        has been closed or the timeout expired. The slot stays pinned until
+        release(seq), and valid(seq) says whether it was kept."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._latest.value > last_seq or self._closed.value, timeout)
+            seq = self._latest.value
+            if seq <= last_seq:
+                return None
+            # The writer never claims the newest slot, so it is still there
+            slot = self._latest_slot.value
+            self._pins[slot] += 1
+            return seq, self._timestamps[slot], self._frames[slot]
+
+    def release(self, seq):
+        """Let the writer have the slot read() gave us back"""
+        with self._condition:
+            slot = self._slot(seq)
+            if slot is not None:
+                self._pins[slot] -= 1
+
+    def __iter__(self):
+        seq = 0
+        while True:
+            frame = self.read(seq)
+            if frame is None:
+                return
+            seq = frame[0]
+            try:
+                yield frame
+            finally:
+                self.release(seq)
+
+    def _slot(self, seq):
+        for slot in range(self.slots):
+            if self._seqs[slot] == seq:
+                return slot
+        return None
+
+    def valid(self, seq):
+        """Is the frame with this sequence number still in a slot?"""
+        return self._slot(seq) is not None
+
+    def capture(self, cap, running=None):
+        """Read frames from a capture device into the ring until it stops.
+        cap.read is given the slot to read into, so there is no copy unless
+        the device insists on handing back its own buffer. The ring is
+        closed when capture stops."""
+        try:
+            while running is None or running.is_set():
+                view = self.claim()
+                retval, image = cap.read(view)
+                # An MJPEGCapture knows when the frame was really captured
+                timestamp = getattr(cap, 'timestamp', None) or time.time()
+                if not retval:
+                    return
+                if image is not view:
+                    np.copyto(view, image)
+                self.publish(timestamp)
+        finally:
+            self.close()
@@ -0,0 +1,144 @@
+"""Search for the HSV thresholds that find the target best.
+
+Scores a grid of HSV bounds against labelled images - by default the ones
+in tests/sample_img/tests.csv - and reports the bounds that get the most
+images right, using as few pixels as possible. Each image is converted to
+HSV once up front, and the candidate bounds are scored in parallel. Run
+from the top of the repository:
+
+    python3 -m vision.tune --labels tests/sample_img/tests.csv more/labels.csv
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+
+import cv2
+
+from vision.vision import TargetFinder, HSVThreshold
+
+# The search grid. Upper saturation and value are always 255.
+HUE_LOW = range(40, 75, 5)
+HUE_HIGH = range(75, 105, 5)
+SATURATION_LOW = range(50, 200, 25)
+VALUE_LOW = range(20, 160, 20)
+
+# Same tolerances as the sample image tests
+POSITION_TOLERANCE = 0.05
+SIZE_TOLERANCE = 0.05
+
+
+class PrecomputedHSV(HSVThreshold):
+    """HSVThreshold for images that have already been converted to HSV"""
+
+    def convert(self, image):
+        return image
+
+
+def loadLabels(filenames):
+    """Read (image filename, x, y, w, h) rows from the label CSV files.
+    Image filenames are relative to the CSV file they are in."""
+    labels = []
+    for filename in filenames:
+        directory = os.path.dirname(filename)
+        with open(filename) as f:
+            for row in csv.reader(f):
+                if len(row) < 5:
+                    continue
+                labels.append((os.path.join(directory, row[0]),
+                               [float(value) for value in row[1:5]]))
+    return labels
+
+
+def correct(result, label):
+    """Does the result match the label, within the test tolerances?"""
+    x, y, w, h = label
+    if w == 0.0:
+        # Labelled as having no target
+        return not result.found
+    return (abs(result.x - x) < POSITION_TOLERANCE and
+            abs(result.y - y) < POSITION_TOLERANCE and
+            abs(result.w - w) < SIZE_TOLERANCE * w and
+            abs(result.h - h) < SIZE_TOLERANCE * h)
+
+
+# Each worker process keeps the HSV images, set up by _initWorker
+_images = None
+_finder = None
+
+
+def _initWorker(images):
+    global _images, _finder
+    _images = images
+    _finder = TargetFinder(PrecomputedHSV())
+
+
+def _score(bounds):
+    """Score one set of bounds. Returns (number correct, pixels, bounds)."""
+    lower, upper = bounds
+    threshold = _finder.threshold
+    threshold.setBounds(lower, upper)
+    right = 0
+    pixels = 0
+    for hsv, label in _images:
+        result = _finder.detect(hsv)
+        if correct(result, label):
+            right += 1
+        mask = cv2.inRange(hsv, threshold.lower_colour, threshold.upper_colour)
+        pixels += cv2.countNonZero(mask)
+    return right, pixels, bounds
+
+
+def candidateBounds():
+    for h_low, h_high, s_low, v_low in itertools.product(HUE_LOW, HUE_HIGH,
+                                                         SATURATION_LOW, VALUE_LOW):
+        yield (h_low, s_low, v_low), (h_high, 255, 255)
+
+
+def tune(labels, workers=None, candidates=None):
+    """Find the best bounds for the labelled images. Returns a dict with the
+    bounds, the fraction of images they get right and the pixels they let
+    through."""
+    if candidates is None:
+        candidates = candidateBounds()
+    images = []
+    for filename, label in labels:
+        image = cv2.imread(filename, cv2.IMREAD_COLOR)
+        if image is None:
+            raise Exception("Could not read labelled image: %s" % filename)
+        images.append((cv2.cvtColor(image, cv2.COLOR_BGR2HSV), label))
+    if not images:
+        raise Exception("No labelled images to tune against")
+    pool = multiprocessing.Pool(workers, _initWorker, (images,))
+    try:
+        scores = pool.map(_score, list(candidates), chunksize=32)
+    finally:
+        pool.close()
+        pool.join()
+    # Most images right first, then the fewest pixels
+    right, pixels, (lower, upper) = max(scores, key=lambda score: (score[0], -score[1]))
+    return {'lower_colour': list(lower),
+            'upper_colour': list(upper),
+            'accuracy': float(right) / len(images),
+            'pixels': pixels,
+            'images': len(images)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune the HSV thresholds against labelled images.')
+    parser.add_argument('--labels', help='CSV files of filename, x, y, w, h', nargs='+',
+                        default=[os.path.join('tests', 'sample_img', 'tests.csv')])
+    parser.add_argument('--workers', help='number of processes to use, defaults to one per core',
+                        type=int, default=None)
+    parser.add_argument('--output', help='write the best bounds to this JSON file', type=str, default=None)
+    args = parser.parse_args()
+
+    best = tune(loadLabels(args.labels), args.workers)
+    print("Lower: %s\nUpper: %s" % (best['lower_colour'], best['upper_colour']))
+    print("Correct on %.0f%% of %d images, %d pixels in the masks" %
+          (best['accuracy'] * 100.0, best['images'], best['pixels']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(best, f, indent=2, sort_keys=True)
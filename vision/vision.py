@@ -1,144 +1,880 @@
 import cv2
 import numpy as np
 import argparse
-import os
-import re
 import time
+import threading
+import multiprocessing
 import logging
-from networktables import NetworkTable
+import os
+from networktables import NetworkTable, NumberArray
+try:
+    from .ringbuffer import FrameRingBuffer
+    from . import record
+    from .camera_settings import setCaptureParameters
+    from .mjpeg import MJPEGCapture
+except (ImportError, SystemError):
+    # Run as a script, or by mjpg-streamer
+    from ringbuffer import FrameRingBuffer
+    import record
+    from camera_settings import setCaptureParameters
+    from mjpeg import MJPEGCapture
+
+def _reserve(buf, shape):
+    """Grow the flat buffer buf if it is too small to hold an image of the
+    given shape, and return it along with a contiguous view of that shape.
+    Lets us reuse one buffer for frames and regions of interest of any
+    size."""
+    size = int(np.prod(shape))
+    if buf.size < size:
+        buf = np.empty(size, buf.dtype)
+    return buf, buf[:size].reshape(shape)
+
+
+class HSVThreshold:
+    """Threshold frames by converting them to HSV and then checking the
+    bounds of each channel."""
+
+    def __init__(self, lower_colour=None, upper_colour=None):
+        self._hsv = np.empty(0, np.uint8)
+        self.setBounds(lower_colour, upper_colour)
+
+    def setBounds(self, lower_colour=None, upper_colour=None):
+        if lower_colour is None:
+            lower_colour = TargetFinder.lower_colour
+        if upper_colour is None:
+            upper_colour = TargetFinder.upper_colour
+        self.lower_colour = np.array(lower_colour)
+        self.upper_colour = np.array(upper_colour)
+
+    def convert(self, image):
+        # Convert from BGR colourspace to HSV. Makes thresholding easier.
+        self._hsv, hsv_image = _reserve(self._hsv, image.shape)
+        cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv_image)
+        return hsv_image
+
+    def threshold(self, converted, mask):
+        # Create a mask that filters out only those colours
+        cv2.inRange(converted, self.lower_colour, self.upper_colour, dst=mask)
+
+
+class LookupThreshold:
+    """Threshold frames with a table mapping every BGR colour, quantised to
+    bits bits per channel, straight to the mask value. The table is laid
+    out as an image with a row for each blue level and a column for each
+    green and red pair, so the lookup is a nearest neighbour cv2.remap, and
+    the coordinates come from per channel cv2.LUTs. Bits can be at most 7,
+    as remap coordinates have to fit in a short.
+
+    This isn't always faster than HSVThreshold. On a desktop cvtColor and
+    inRange are heavily vectorised and win by about 1.5x, so measure with
+    vision.benchmark --lookup on the co-processor before using it."""
+
+    max_bits = 7
+
+    def __init__(self, lower_colour=None, upper_colour=None, bits=7):
+        if not 1 <= bits <= self.max_bits:
+            raise ValueError("LookupThreshold bits must be from 1 to %d, not %d"
+                             % (self.max_bits, bits))
+        self.bits = bits
+        shift = 8 - bits
+        n = 1 << bits
+        levels = np.arange(256) >> shift
+        self._row_lut = levels.astype(np.float32).reshape(256, 1)
+        self._column_lut = (levels * n).astype(np.float32).reshape(256, 1)
+        # Use the colour in the middle of each quantised bin
+        centres = (np.arange(n) << shift) + ((1 << shift) >> 1)
+        cube = np.empty((n, n, n, 3), np.uint8)
+        cube[..., 0] = centres[:, np.newaxis, np.newaxis]
+        cube[..., 1] = centres[np.newaxis, :, np.newaxis]
+        cube[..., 2] = centres[np.newaxis, np.newaxis, :]
+        # Keep the HSV value of every colour, so changing the thresholds
+        # only needs an inRange over the table rather than a conversion
+        self._hsv_table = cv2.cvtColor(cube.reshape(n, n * n, 3), cv2.COLOR_BGR2HSV)
+        self._planes = [np.empty(0, np.uint8) for _ in range(3)]
+        self._x = np.empty(0, np.float32)
+        self._y = np.empty(0, np.float32)
+        self._red = np.empty(0, np.float32)
+        self.setBounds(lower_colour, upper_colour)
+
+    def setBounds(self, lower_colour=None, upper_colour=None):
+        if lower_colour is None:
+            lower_colour = TargetFinder.lower_colour
+        if upper_colour is None:
+            upper_colour = TargetFinder.upper_colour
+        self.lower_colour = np.array(lower_colour)
+        self.upper_colour = np.array(upper_colour)
+        self.table = cv2.inRange(self._hsv_table, self.lower_colour, self.upper_colour)
+
+    def convert(self, image):
+        # Work out where each pixel's colour is in the table
+        shape = image.shape[:2]
+        planes = []
+        for i, buf in enumerate(self._planes):
+            self._planes[i], plane = _reserve(buf, shape)
+            planes.append(plane)
+        cv2.split(image, planes)
+        self._x, x = _reserve(self._x, shape)
+        self._y, y = _reserve(self._y, shape)
+        self._red, red = _reserve(self._red, shape)
+        cv2.LUT(planes[0], self._row_lut, dst=y)
+        cv2.LUT(planes[1], self._column_lut, dst=x)
+        cv2.LUT(planes[2], self._row_lut, dst=red)
+        cv2.add(x, red, dst=x)
+        return x, y
+
+    def threshold(self, converted, mask):
+        x, y = converted
+        cv2.remap(self.table, x, y, cv2.INTER_NEAREST, dst=mask)
+
+
+class TargetResult:
+    """What we found in a frame. x, y, w and h are normalised to the frame
+    (x and y from -1 to 1), and are all 0.0 if there is no target. rect is
+    the minAreaRect in pixels for drawing. capture_time is when the frame
+    was captured and process_time when we finished with it, both from
+    time.time()."""
+
+    __slots__ = ('x', 'y', 'w', 'h', 'rect', 'score',
+                 'capture_time', 'process_time')
+
+    def __init__(self, x=0.0, y=0.0, w=0.0, h=0.0, rect=None, score=0.0,
+                 capture_time=None, process_time=None):
+        if capture_time is None:
+            capture_time = time.time()
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.rect = rect
+        self.score = score
+        self.capture_time = capture_time
+        self.process_time = process_time
+
+    @property
+    def found(self):
+        return self.w > 0.0
+
+    @property
+    def latency(self):
+        return self.process_time - self.capture_time
+
+    def done(self):
+        self.process_time = time.time()
+        return self
+
+    def __repr__(self):
+        return ("TargetResult(x=%f, y=%f, w=%f, h=%f, score=%f)"
+                % (self.x, self.y, self.w, self.h, self.score))
+
+
+def render(image, result):
+    """Draw the result onto the image for a human to look at"""
+    if result.rect is not None:
+        # Draw the box
+        box = cv2.boxPoints(result.rect)
+        box = np.int0(box)
+        cv2.drawContours(image, [box], 0, (0, 0, 255), 2)
+        # Draw the centre point
+        (x, y) = result.rect[0]
+        cv2.circle(image, (int(x), int(y)), 2, (0, 0, 255), 2)
+    return image
+
+
+class Detector:
+    """Base for the things that can find a target. Subclasses implement
+    detect(image, roi, timestamp), which doesn't touch the image and
+    returns a TargetResult."""
+
+    def findTarget(self, image, roi=None):
+        """Find the target and draw it onto the image.
+        Returns (x, y, w, h, image)."""
+        result = self.detect(image, roi)
+        render(image, result)
+        return result.x, result.y, result.w, result.h, image
+
+
+class Candidate:
+    """A blob that might be the target. x, y, w and h are in the same units
+    as findTarget's results, bounds is the (left, top, width, height)
+    bounding box in pixels."""
+
+    __slots__ = ('x', 'y', 'w', 'h', 'area', 'score', 'bounds')
+
+    def __init__(self, x, y, w, h, area, score, bounds):
+        self.x = float(x)
+        self.y = float(y)
+        self.w = float(w)
+        self.h = float(h)
+        self.area = float(area)
+        self.score = float(score)
+        self.bounds = bounds
+
+    def __repr__(self):
+        return ("Candidate(x=%f, y=%f, w=%f, h=%f, area=%f, score=%f)"
+                % (self.x, self.y, self.w, self.h, self.area, self.score))
+
+
+class TargetFinder(Detector):
+    """Find the target in a frame without allocating any images per frame.
+    The thresholds are built once, and the intermediate images are kept
+    between calls and written to through OpenCV's dst arguments. The
+    thresholding backend can be swapped out with the threshold argument."""
 
-def findTarget(image):
-    height = image.shape[0]
-    width = image.shape[1]
-    # Convert from BGR colourspace to HSV. Makes thresholding easier.
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     # Define the colours to look for (in HSV)
     # Use values straight from GIMP
     lower_colour = np.array([120 * 0.5, 50 * 255 / 100, 15 * 255 / 100])
     upper_colour = np.array([180 * 0.5, 100 * 255 / 100, 100 * 255 / 100])
-    # Create a mask that filters out only those colours
-    mask = cv2.inRange(hsv_image, lower_colour, upper_colour)
-    # Errode and dialate the image to get rid of noise
-    kernel = np.ones((4, 4), np.uint8)
-    erosion = cv2.erode(mask, kernel, iterations=1)
-    dilated = mask#cv2.dilate(erosion, kernel, iterations=1)
-    # Get the information for the contours
-    _, contours, __ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    # sort the contours into a list
-    areas = [cv2.contourArea(contour) for contour in contours]
-    # and retrieve the largest contour in the list
-    cnt = None
-    try:
-        cnt = contours[np.argmax(areas)]
-    except ValueError:
-        return 0.0, 0.0, 0.0, 0.0, image
-
-    # Draw the contours
-    cv2.drawContours(image, contours, 0, (255, 0, 0), 1)
-
-    # get the area of the contour
-    area = cv2.contourArea(cnt)
-    if area / width / height > 0.05:
-        return 0.0, 0.0, 0.0, 0.0, image
-    # get a rectangle and then a box around the largest countour
-    rect = cv2.minAreaRect(cnt)
-
-    # Draw the box
-    box = cv2.boxPoints(rect)
-    box = np.int0(box)
-    cv2.drawContours(image, [box], 0, (0, 0, 255), 2)
-    (xy, wh, rotation_angle) = (rect[0], rect[1], rect[2])
-    # Converting the width and height variables to inbetween -1 and 1
-    try:
-        (x, y) = xy
-        (w, h) = wh
-    except ValueError:
-        return 0.0, 0.0, 0.0, 0.0, image
-    if rotation_angle < -45.0 or rotation_angle > 45.0:
-        w, h = h, w
-    # Draw the centre point
-    cv2.circle(image, (int(x), int(y)), 2, (0, 0, 255), 2)
-    x = ((2 * x) / width) - 1
-    y = ((2 * y) / height) - 1
-    w = w / width
-    h = h / height
-    # Send the results to NetworkTables
-    # TODO!!
-
-    return x, y, w, h, image
+
+    # Anything bigger than this fraction of the frame can't be the target
+    max_area_fraction = 0.05
+    # Candidate scoring. The target is a 20" x 14" U of 2" wide tape.
+    min_area = 10  # pixels
+    target_aspect = 20.0 / 14.0
+    target_fill = (2 * 14 * 2 + 16 * 2) / (20.0 * 14.0)
+    position_weight = 0.25
+
+    def __init__(self, threshold=None, scored=False):
+        if threshold is None:
+            threshold = HSVThreshold()
+        self.threshold = threshold
+        # Pick the best scoring candidate instead of the largest blob
+        self.scored = scored
+        self._mask = np.empty(0, np.uint8)
+        self._labels = np.empty(0, np.int32)
+
+    def _threshold(self, image, roi):
+        # Only the region of interest (x0, y0, x1, y1) is thresholded if
+        # there is one. Returns the mask and the offset of its corner.
+        x0, y0 = 0, 0
+        window = image
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            window = image[y0:y1, x0:x1]
+        self._mask, mask = _reserve(self._mask, window.shape[:2])
+        self.threshold.threshold(self.threshold.convert(window), mask)
+        return mask, x0, y0
+
+    def findContours(self, image, roi=None):
+        """Threshold the image and return its outer contours and their
+        areas. Only the region of interest (x0, y0, x1, y1) is searched if
+        there is one, but the contours are always in full frame
+        coordinates."""
+        mask, x0, y0 = self._threshold(image, roi)
+        # Holes are always smaller than the contour around them, so we only
+        # need the outside contours to find the largest one
+        _, contours, __ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                              offset=(x0, y0))
+        areas = [cv2.contourArea(contour) for contour in contours]
+        return contours, areas
+
+    def findCandidates(self, image, count=3, roi=None):
+        """Score every blob in the image on its area, aspect ratio, fill
+        ratio and position, and return the best count of them as a list of
+        Candidates, best first. The blob statistics all come from a single
+        connected components pass."""
+        mask, x0, y0 = self._threshold(image, roi)
+        return self._scoreBlobs(mask, x0, y0, image.shape[1], image.shape[0], count)
+
+    def _scoreBlobs(self, mask, x0, y0, width, height, count):
+        self._labels, labels = _reserve(self._labels, mask.shape)
+        _, _, stats, __ = cv2.connectedComponentsWithStats(mask, labels, connectivity=8)
+        # Label 0 is the background
+        stats = stats[1:]
+        areas = stats[:, cv2.CC_STAT_AREA].astype(float)
+        keep = ((areas >= self.min_area) &
+                (areas / width / height <= self.max_area_fraction))
+        stats = stats[keep]
+        areas = areas[keep]
+        if not len(areas):
+            return []
+        left = (stats[:, cv2.CC_STAT_LEFT] + x0).astype(float)
+        top = (stats[:, cv2.CC_STAT_TOP] + y0).astype(float)
+        box_width = stats[:, cv2.CC_STAT_WIDTH].astype(float)
+        box_height = stats[:, cv2.CC_STAT_HEIGHT].astype(float)
+        x = (2.0 * left + box_width) / width - 1.0
+        y = (2.0 * top + box_height) / height - 1.0
+        # Each term is 1.0 for a perfect match, falling towards 0.0
+        aspect = box_width / box_height / self.target_aspect
+        fill = areas / (box_width * box_height) / self.target_fill
+        scores = (areas / areas.max() *
+                  np.minimum(aspect, 1.0 / aspect) *
+                  np.minimum(fill, 1.0 / fill) *
+                  (1.0 - self.position_weight * (x ** 2 + y ** 2) / 2.0))
+        candidates = []
+        for i in np.argsort(-scores)[:count]:
+            candidates.append(Candidate(x[i], y[i], box_width[i] / width,
+                                        box_height[i] / height, areas[i], scores[i],
+                                        (int(left[i]), int(top[i]),
+                                         int(box_width[i]), int(box_height[i]))))
+        return candidates
+
+    def detect(self, image, roi=None, timestamp=None):
+        result = TargetResult(capture_time=timestamp)
+        height = image.shape[0]
+        width = image.shape[1]
+        if self.scored:
+            return self._detectScored(image, roi, result)
+        contours, areas = self.findContours(image, roi)
+        # retrieve the largest contour in the list
+        try:
+            largest = np.argmax(areas)
+        except ValueError:
+            return result.done()
+        cnt = contours[largest]
+
+        # get the area of the contour
+        area = areas[largest]
+        if area / width / height > self.max_area_fraction:
+            return result.done()
+        # get a rectangle and then a box around the largest countour
+        return self._fromRect(result, cv2.minAreaRect(cnt), width, height, 1.0)
+
+    def _detectScored(self, image, roi, result):
+        height = image.shape[0]
+        width = image.shape[1]
+        mask, x0, y0 = self._threshold(image, roi)
+        candidates = self._scoreBlobs(mask, x0, y0, width, height, 1)
+        if not candidates:
+            return result.done()
+        best = candidates[0]
+        # The score only has the bounding box, so fit the rectangle to the
+        # blob's own outline inside it
+        left, top, w, h = best.bounds
+        window = mask[top - y0:top - y0 + h, left - x0:left - x0 + w]
+        _, contours, __ = cv2.findContours(window, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                              offset=(left, top))
+        # Corners of other blobs can fall inside the box too
+        cnt = max(contours, key=cv2.contourArea)
+        return self._fromRect(result, cv2.minAreaRect(cnt), width, height, best.score)
+
+    def _fromRect(self, result, rect, width, height, score):
+        (xy, wh, rotation_angle) = (rect[0], rect[1], rect[2])
+        # Converting the width and height variables to inbetween -1 and 1
+        try:
+            (x, y) = xy
+            (w, h) = wh
+        except ValueError:
+            return result.done()
+        if rotation_angle < -45.0 or rotation_angle > 45.0:
+            w, h = h, w
+        result.x = ((2 * x) / width) - 1
+        result.y = ((2 * y) / height) - 1
+        result.w = w / width
+        result.h = h / height
+        result.rect = rect
+        result.score = score
+        return result.done()
+
+
+class PyramidFinder(Detector):
+    """Search for the target in a downscaled copy of the frame, then refine
+    the rectangle and centre point in the matching full resolution crop.
+    Most of the work is done at the lower resolution, so the cost drops
+    with the square of the scale, while the result keeps full resolution
+    accuracy."""
+
+    def __init__(self, scale=0.5, margin=4, finder=None,
+                 interpolation=cv2.INTER_AREA):
+        if finder is None:
+            finder = TargetFinder()
+        # The same finder (and buffers) does both passes
+        self.finder = finder
+        self.scale = scale
+        # Extra pixels around the coarse target to allow for rounding
+        self.margin = margin
+        self.interpolation = interpolation
+        self._small = np.empty(0, np.uint8)
+
+    def detect(self, image, roi=None, timestamp=None):
+        if roi is not None:
+            # Already a small search, so go straight to full resolution
+            return self.finder.detect(image, roi, timestamp)
+        height = image.shape[0]
+        width = image.shape[1]
+        small_width = max(int(width * self.scale), 1)
+        small_height = max(int(height * self.scale), 1)
+        self._small, small = _reserve(self._small,
+                                      (small_height, small_width) + image.shape[2:])
+        cv2.resize(image, (small_width, small_height), dst=small,
+                   interpolation=self.interpolation)
+        contours, areas = self.finder.findContours(small)
+        try:
+            largest = np.argmax(areas)
+        except ValueError:
+            return TargetResult(capture_time=timestamp).done()
+        x, y, w, h = cv2.boundingRect(contours[largest])
+        scale_x = float(width) / small_width
+        scale_y = float(height) / small_height
+        roi = (max(int(x * scale_x) - self.margin, 0),
+               max(int(y * scale_y) - self.margin, 0),
+               min(int((x + w) * scale_x) + self.margin + 1, width),
+               min(int((y + h) * scale_y) + self.margin + 1, height))
+        return self.finder.detect(image, roi, timestamp)
+
+
+# Shared by everything that calls findTarget from the main thread
+_finder = TargetFinder()
+
+
+def findTarget(image, roi=None):
+    return _finder.findTarget(image, roi)
+
+
+class TargetTracker(Detector):
+    """Track the target from frame to frame by only searching a padded
+    window around the last detection. Falls back to a full frame scan
+    when the target is lost or runs into the edge of the window."""
+
+    def __init__(self, padding=1.0, min_size=16, finder=None):
+        if finder is None:
+            finder = TargetFinder()
+        self.finder = finder
+        # Extra space around the target on each side, as a fraction of
+        # the target size
+        self.padding = padding
+        # Smallest half-width of the search window in pixels
+        self.min_size = min_size
+        self.roi = None
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def reset(self):
+        self.roi = None
+
+    def detect(self, image, roi=None, timestamp=None):
+        if roi is not None:
+            # Asked to look somewhere in particular, so don't track
+            return self.finder.detect(image, roi, timestamp)
+        height = image.shape[0]
+        width = image.shape[1]
+        if self.roi is not None:
+            self.roi_scans += 1
+            result = self.finder.detect(image, self.roi, timestamp)
+            if result.found and not self._touchesEdge(result, width, height):
+                self.roi = self._window(result, width, height)
+                return result
+        # Lost the target (or never had it) so look everywhere
+        self.full_scans += 1
+        result = self.finder.detect(image, None, timestamp)
+        if result.found:
+            self.roi = self._window(result, width, height)
+        else:
+            self.roi = None
+        return result
+
+    def _extent(self, result, width, height):
+        """Convert a normalised result back to a pixel centre and a radius
+        that covers the rotated box."""
+        cx = (result.x + 1.0) * width / 2.0
+        cy = (result.y + 1.0) * height / 2.0
+        radius = 0.5 * ((result.w * width) ** 2 + (result.h * height) ** 2) ** 0.5
+        return cx, cy, radius
+
+    def _window(self, result, width, height):
+        cx, cy, radius = self._extent(result, width, height)
+        half = max(radius * (1.0 + self.padding), self.min_size)
+        return (max(int(cx - half), 0), max(int(cy - half), 0),
+                min(int(cx + half) + 1, width), min(int(cy + half) + 1, height))
+
+    def _touchesEdge(self, result, width, height):
+        # Edges of the window that are also edges of the frame don't count,
+        # as a full scan won't find any more of the target there
+        cx, cy, radius = self._extent(result, width, height)
+        x0, y0, x1, y1 = self.roi
+        return ((x0 > 0 and cx - radius <= x0) or
+                (y0 > 0 and cy - radius <= y0) or
+                (x1 < width and cx + radius >= x1) or
+                (y1 < height and cy + radius >= y1))
+
+
+class FrameBudget(Detector):
+    """Keep the time spent on each frame within a budget (in seconds), by
+    trading accuracy for speed when the processor gets busy and back again
+    when it isn't. The modes, from best to cheapest:
+
+    track   - track the target at full resolution
+    half    - full scans at half resolution, and a tighter tracking window
+    quarter - full scans at quarter resolution
+    skip    - as quarter, but only every other frame
+
+    detect() returns None for frames that are skipped."""
+
+    MODES = ('track', 'half', 'quarter', 'skip')
+
+    def __init__(self, budget=1.0 / 30.0, finder=None, smoothing=0.2,
+                 margin=0.8, settle=10):
+        if finder is None:
+            finder = TargetFinder()
+        self.budget = budget
+        self.smoothing = smoothing
+        # Only move to a better mode if it should fit in this much of the budget
+        self.margin = margin
+        # Frames to wait after changing mode before changing again
+        self.settle = settle
+        # The cheaper modes do their own downscaling, so they need the
+        # TargetFinder from inside a PyramidFinder (from --scale)
+        base = getattr(finder, 'finder', finder)
+        self._finders = [finder, PyramidFinder(0.5, finder=base),
+                         PyramidFinder(0.25, finder=base), PyramidFinder(0.25, finder=base)]
+        self._padding = [1.0, 0.5, 0.5, 0.5]
+        self.tracker = TargetTracker(finder=finder)
+        self.processed = 0
+        self.skipped = 0
+        self.changes = 0
+        # How much more each mode costs than the next cheaper one, measured
+        # either side of a change. Guess at twice until we know.
+        self._ratios = [2.0, 2.0, 1.0]
+        self._frame = 0
+        self._setLevel(0)
+
+    @property
+    def mode(self):
+        return self.MODES[self.level]
+
+    def _setLevel(self, level, average=None):
+        if average is not None:
+            self._changed_from = (self.level, average)
+            self.changes += 1
+        else:
+            self._changed_from = None
+        self.level = level
+        self.tracker.finder = self._finders[level]
+        self.tracker.padding = self._padding[level]
+        self.average = None
+        self._since_change = 0
+
+    def detect(self, image, roi=None, timestamp=None):
+        self._frame += 1
+        if self.mode == 'skip' and self._frame % 2:
+            self.skipped += 1
+            return None
+        start = time.perf_counter()
+        result = self.tracker.detect(image, roi, timestamp)
+        self.record(time.perf_counter() - start)
+        return result
+
+    def record(self, elapsed):
+        """Note that a frame took elapsed seconds, and change mode if we need to"""
+        self.processed += 1
+        self._since_change += 1
+        if self.average is None:
+            self.average = elapsed
+        else:
+            self.average += self.smoothing * (elapsed - self.average)
+        if self._since_change < self.settle:
+            return
+        if self._changed_from is not None:
+            level, average = self._changed_from
+            if level < self.level:
+                self._ratios[level] = average / max(self.average, 1e-6)
+            else:
+                self._ratios[self.level] = self.average / max(average, 1e-6)
+            self._changed_from = None
+        # Skipping every other frame gives us twice the time for the others
+        allowed = self.budget * (2.0 if self.mode == 'skip' else 1.0)
+        if self.average > allowed and self.level < len(self.MODES) - 1:
+            self._setLevel(self.level + 1, self.average)
+        elif (self.level > 0 and
+              self.average * self._ratios[self.level - 1] < self.budget * self.margin):
+            self._setLevel(self.level - 1, self.average)
+
+
+class MotionGate(Detector):
+    """Reuse the last result while the scene isn't changing, rather than
+    running the detector on frame after frame of the same thing. Each
+    frame is shrunk to a thumbnail and compared with the thumbnail of the
+    last frame that was processed. If no part of it has changed by more
+    than threshold (out of 255), the last result is handed back with the
+    new frame's timestamp. Every max_skip frames we process one anyway."""
+
+    def __init__(self, detector=None, size=(40, 30), threshold=8.0, max_skip=15):
+        if detector is None:
+            detector = TargetTracker()
+        self.detector = detector
+        self.size = size
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.processed = 0
+        self.skipped = 0
+        self._small = np.empty(0, np.uint8)
+        self._reference = np.empty(0, np.uint8)
+        self._result = None
+        self._run = 0
+
+    @property
+    def mode(self):
+        return getattr(self.detector, 'mode', 'track')
+
+    def detect(self, image, roi=None, timestamp=None):
+        width, height = self.size
+        shape = (height, width) + image.shape[2:]
+        self._small, small = _reserve(self._small, shape)
+        cv2.resize(image, self.size, dst=small, interpolation=cv2.INTER_AREA)
+        if (roi is None and self._result is not None and self._run < self.max_skip and
+                cv2.norm(small, self._reference[:small.size].reshape(shape),
+                         cv2.NORM_INF) <= self.threshold):
+            self.skipped += 1
+            self._run += 1
+            last = self._result
+            return TargetResult(last.x, last.y, last.w, last.h, last.rect, last.score,
+                                timestamp).done()
+        result = self.detector.detect(image, roi, timestamp)
+        if result is None:
+            # Skipped by the detector, so there's nothing to compare with
+            return None
+        self.processed += 1
+        self._run = 0
+        self._result = result
+        self._reference, reference = _reserve(self._reference, shape)
+        np.copyto(reference, small)
+        return result
+
 
 class NTWrapper:  # pragma: no cover
-    def __init__(self):
+    def __init__(self, finder=None, udp=None, budget=None):
         NetworkTable.setIPAddress('127.0.0.1')
         NetworkTable.setClientMode()
         NetworkTable.initialize()
         self.nt = NetworkTable.getTable("vision")
+        if budget is not None:
+            self.tracker = FrameBudget(budget, finder)
+        else:
+            self.tracker = TargetTracker(finder=finder)
+        self.mode = None
+        self.seq = 0
+        # Results also go straight to this host over UDP, if there is one
+        self.sender = None
+        if udp is not None:
+            self.sender = record.RecordSender(udp)
 
-    def findTargetNetworkTables(self, image):
-        x, y, w, h, img = findTarget(image)
-        # TODO - send to network tables
-        self.nt.putDouble('x', x)
-        self.nt.putDouble('y', y)
-        self.nt.putDouble('w', w)
-        self.nt.putDouble('h', h)
-        self.nt.putDouble('time', time.time())
-        return img
+    def findTargetNetworkTables(self, image, timestamp=None):
+        # Frames handed to us without a capture time are treated as fresh
+        result = self.tracker.detect(image, None, timestamp)
+        if result is None:
+            # Skipped to stay within the frame budget
+            return image
+        self.publish(result)
+        # The image goes on to the driver station stream, so draw on it
+        return render(image, result)
 
+    def publish(self, result):
+        mode = getattr(self.tracker, 'mode', 'track')
+        if mode != self.mode:
+            self.mode = mode
+            self.nt.putString('mode', mode)
+        # One update per frame, so the robot never sees half of a result
+        self.seq += 1
+        values = record.pack(self.seq, result, time.time())
+        if self.sender is not None:
+            self.sender.send(values)
+        self.nt.putValue(record.KEY, NumberArray.from_list(values))
 
-def init_filter():  # pragma: no cover
-    ntw = NTWrapper()
-    return ntw.findTargetNetworkTables
 
+class FrameGrabber:
+    """Read frames from a capture device on a background thread, keeping
+    only the newest one. V4L2 buffers frames, so reading in line with the
+    processing means we often work on frames that are several periods old.
+    Frames that are replaced before anybody reads them are dropped."""
 
-def setCaptureParameters(device,
-                         mjpg_config_file='mjpg-streamer'):  # pragma: no cover
-    if not os.path.exists(device):
-        raise Exception("No such video device: %s" % device)
+    def __init__(self, cap):
+        self.cap = cap
+        self.frames = 0
+        self.dropped = 0
+        self._condition = threading.Condition()
+        self._image = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._taken = 0
+        self._running = False
+        self._thread = None
 
-    logger = logging.getLogger("vision")
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            retval, image = self.cap.read()
+            # mjpg-streamer sends when it captured the frame, which is
+            # earlier than now, and on the same clock if it is local
+            timestamp = getattr(self.cap, 'timestamp', None) or time.time()
+            with self._condition:
+                if not retval:
+                    # End of the stream, or the device has gone away
+                    self._running = False
+                    self._condition.notify_all()
+                    return
+                if self._taken < self._seq:
+                    self.dropped += 1
+                self.frames += 1
+                self._seq += 1
+                self._image = image
+                self._timestamp = timestamp
+                self._condition.notify_all()
+
+    def read(self, timeout=None):
+        """Wait for a frame newer than the last one returned.
+        Returns (seq, timestamp, image), or None if capture has stopped
+        or the timeout expired."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._seq > self._taken or not self._running, timeout)
+            if self._seq <= self._taken:
+                return None
+            self._taken = self._seq
+            return self._seq, self._timestamp, self._image
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+
+def _poolWorker(buffers, shape, tasks, results, finder=None):
+    # Views onto the shared frame slots, so frames never get pickled
+    frames = [np.frombuffer(buf, dtype=np.uint8).reshape(shape)
+              for buf in buffers]
+    if finder is None:
+        finder = TargetFinder()
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, slot, timestamp = task
+        results.put((seq, slot, finder.detect(frames[slot], None, timestamp)))
+
+
+class VisionWorkerPool:
+    """Spread frames over a pool of worker processes. Frames are copied into
+    shared memory slots, and only the slot number is sent to the workers.
+    Results are published from a background thread in capture order - a
+    result that finishes after a newer frame's result has been published
+    is dropped. Each worker gets its own copy of finder, which defaults to
+    a plain TargetFinder."""
+
+    def __init__(self, shape, workers=None, publish=None, finder=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.shape = tuple(shape)
+        self.publish = publish
+        # Two slots per worker so the next frame can be queued while the
+        # current one is processed
+        size = int(np.prod(self.shape))
+        self._buffers = [multiprocessing.RawArray('B', size)
+                         for _ in range(2 * workers)]
+        self._frames = [np.frombuffer(buf, dtype=np.uint8).reshape(self.shape)
+                        for buf in self._buffers]
+        self._free = list(range(len(self._buffers)))
+        self._lock = threading.Lock()
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._workers = []
+        for _ in range(workers):
+            worker = multiprocessing.Process(target=_poolWorker,
+                                             args=(self._buffers, self.shape,
+                                                   self._tasks, self._results, finder))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._seq = 0
+        self._last_seq = 0
+        self.published = 0
+        self.stale = 0
+        self.skipped = 0
+        self._collector = threading.Thread(target=self._collect,
+                                           name="VisionWorkerPool")
+        self._collector.daemon = True
+        self._collector.start()
+
+    def submit(self, image, timestamp=None):
+        """Queue a frame for processing. Returns False if every slot is busy,
+        in which case the frame is skipped."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if not self._free:
+                self.skipped += 1
+                return False
+            slot = self._free.pop()
+        np.copyto(self._frames[slot], image)
+        self._seq += 1
+        self._tasks.put((self._seq, slot, timestamp))
+        return True
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._buffers) - len(self._free)
+
+    def _collect(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            seq, slot, target = result
+            with self._lock:
+                self._free.append(slot)
+                if seq < self._last_seq:
+                    self.stale += 1
+                    continue
+                self._last_seq = seq
+                self.published += 1
+            if self.publish is not None:
+                self.publish(target)
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._results.put(None)
+        self._collector.join()
+
+
+def openCapture(device, reduce=1):  # pragma: no cover
+    """Open a capture device, or an mjpg-streamer stream if device is a URL.
+    Frames from the stream are decoded at 1/reduce of their full size."""
+    if device.startswith('http://') or device.startswith('https://'):
+        return MJPEGCapture(device, reduce)
+    setCaptureParameters(device)
+    return cv2.VideoCapture(device)
+
+
+def _captureProcess(ring, device, reduce=1):  # pragma: no cover
+    ring.capture(openCapture(device, reduce))
+
+
+def init_filter():
+    # mjpg-streamer runs us on the roboRIO, next to the robot code, so send
+    # the records straight to it over UDP as well. VISION_UDP can point
+    # them somewhere else, or turn them off if it is empty.
+    udp = os.environ.get('VISION_UDP', '127.0.0.1') or None
+    ntw = NTWrapper(udp=udp)
+    return ntw.findTargetNetworkTables
 
-    root_device = os.path.realpath(device)
-
-    # Try to find the settings from the mjpg-streamer config file
-    v4l2_str = "v4l2-ctl -d %s" % device
-    try:
-        with open(mjpg_config_file) as f:
-            for line in f:
-                # Follow symlinks to see if they point at the same device
-                if "--device" in line:
-                    p = re.compile('--device ([^ \t\n\r\f\v"\']+)')
-                    if os.path.realpath(p.search(line).group(1)) == root_device:
-                        # A bunch of regexes to find the parameters
-                        p = re.compile('-ex ([0-9]+)')
-                        if p.search(line):
-                            v4l2_str += (" -c exposure_auto=1 -c exposure_absolute=%s"
-                                         % p.search(line).group(1))
-                            logger.info("Found exposure setting: %s"
-                                        % p.search(line).group(1))
-                        p = re.compile('-br ([0-9]+)')
-                        if p.search(line):
-                            v4l2_str += " -c brightness=%s" % p.search(line).group(1)
-                            logger.info("Found brightness setting: %s"
-                                        % p.search(line).group(1))
-                        p = re.compile('-co ([0-9]+)')
-                        if p.search(line):
-                            v4l2_str += " -c contrast=%s" % p.search(line).group(1)
-                            logger.info("Found contrast setting: %s"
-                                        % p.search(line).group(1))
-                        p = re.compile('-sa ([0-9]+)')
-                        if p.search(line):
-                            v4l2_str += " -c saturation=%s" % p.search(line).group(1)
-                            logger.info("Found saturation setting: %s"
-                                        % p.search(line).group(1))
-        os.system(v4l2_str)
-    except:
-        raise  # pass  # File not found
 
 # Allow easy capturing of sample images using same settings as on robot
 if __name__ == "__main__":
     logger = logging.getLogger("vision")
     parser = argparse.ArgumentParser(description='Capture sample image.')
-    parser.add_argument('--device', help='capture device', default='/dev/video0')
+    parser.add_argument('--device', help='capture device, or the URL of an mjpg-streamer stream',
+            default='/dev/video0')
+    parser.add_argument('--reduce', help='decode frames from an mjpg-streamer stream at 1/2, 1/4 or 1/8 size (only faster from OpenCV 3.4.10)',
+            type=int, default=1)
     parser.add_argument('--video', help='display a live video feed of the capture', action='store_true')
     parser.add_argument('--file', help='capture image to a file', type=str, default=None)
     parser.add_argument('--verbose',
@@ -146,38 +882,115 @@ if __name__ == "__main__":
             default=None)
     parser.add_argument('--showfile', help='display a specific file with a bounding box drawn around it',
             type=str, default=None)
+    parser.add_argument('--track', help='only search around the last detection in the video feed',
+            action='store_true')
+    parser.add_argument('--networktables', help='send results from the capture device to NetworkTables',
+            action='store_true')
+    parser.add_argument('--lookup', help='threshold through a colour lookup table quantised to this many bits (1-7), not always faster, measure it',
+            type=int, default=None)
+    parser.add_argument('--score', help='take the blob most like the target instead of the largest one',
+            action='store_true')
+    parser.add_argument('--scale', help='search a downscaled frame first, then refine at full resolution',
+            type=float, default=None)
+    parser.add_argument('--workers', help='number of processes to run findTarget in with --networktables',
+            type=int, default=1)
+    parser.add_argument('--udp', help='also send results from --networktables to this host over UDP',
+            type=str, default=None)
+    parser.add_argument('--budget', help='milliseconds each frame may take, trading accuracy for speed to stay within it',
+            type=float, default=None)
+    parser.add_argument('--gate', help="reuse the last result while the scene isn't changing",
+            action='store_true')
+    parser.add_argument('--capture-process', help='capture in a separate process, passing frames through shared memory',
+            action='store_true')
     args = parser.parse_args()
+    if args.workers > 1 and (args.budget or args.gate):
+        # Both depend on seeing every frame in order, and the workers each
+        # only see some of them
+        parser.error('--budget and --gate only work with one worker')
 
     logging.basicConfig(level=20)  # Show info messages
 
     cap = None
-    if args.file or args.video:
-        setCaptureParameters(args.device)
-        cap = cv2.VideoCapture(args.device)
-        logger.info("Brightness: %f" % cap.get(cv2.CAP_PROP_BRIGHTNESS))
-        logger.info("Contrast: %f" % cap.get(cv2.CAP_PROP_CONTRAST))
-        logger.info("Saturation: %f" % cap.get(cv2.CAP_PROP_SATURATION))
-        logger.info("Exposure: %f" % cap.get(cv2.CAP_PROP_EXPOSURE))
+    if args.file or args.video or args.networktables:
+        cap = openCapture(args.device, args.reduce)
+        if not isinstance(cap, MJPEGCapture):
+            logger.info("Brightness: %f" % cap.get(cv2.CAP_PROP_BRIGHTNESS))
+            logger.info("Contrast: %f" % cap.get(cv2.CAP_PROP_CONTRAST))
+            logger.info("Saturation: %f" % cap.get(cv2.CAP_PROP_SATURATION))
+            logger.info("Exposure: %f" % cap.get(cv2.CAP_PROP_EXPOSURE))
+    finder = TargetFinder(scored=args.score)
+    if args.lookup:
+        finder = TargetFinder(LookupThreshold(bits=args.lookup), scored=args.score)
+    if args.scale:
+        finder = PyramidFinder(args.scale, finder=finder)
     if args.file:
         retval, image = cap.read()
         if retval:
-            x, y, w, h, image = findTarget(image)
+            render(image, finder.detect(image))
             cv2.imwrite(args.file, image)
     if args.verbose:
         image = cv2.imread(args.verbose, cv2.IMREAD_COLOR)
-        x, y, w, h, image = findTarget(image)
-        # print("x: %f\ny: %f\nwidth: %f\nheight: %f" % (x, y, w, h))
+        result = finder.detect(image)
+        # print("x: %f\ny: %f\nwidth: %f\nheight: %f" % (result.x, result.y, result.w, result.h))
     if args.showfile:
         image = cv2.imread(args.showfile, cv2.IMREAD_COLOR)
-        x, y, w, h, image = findTarget(image)
+        render(image, finder.detect(image))
         cv2.imshow('image', image)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
+    source = None
+    valid = lambda seq: True
+    if args.video or args.networktables:
+        if args.capture_process:
+            # The capture process opens the device itself, we just need the frame size
+            retval, image = cap.read()
+            cap.release()
+            source = FrameRingBuffer(3, image.shape)
+            valid = source.valid
+            capture = multiprocessing.Process(target=_captureProcess, args=(source, args.device, args.reduce))
+            capture.daemon = True
+            capture.start()
+        else:
+            source = FrameGrabber(cap).start()
     if args.video:
         window = cv2.namedWindow("preview")
-        while True:
-            retval, image = cap.read()
-            x, y, w, h, image = findTarget(image)
-            cv2.imshow("preview", image)
+        detector = finder
+        if args.track:
+            detector = TargetTracker(finder=finder)
+        if args.budget:
+            detector = FrameBudget(args.budget / 1000.0, finder)
+        if args.gate:
+            detector = MotionGate(detector)
+        for seq, timestamp, image in source:
+            result = detector.detect(image, None, timestamp)
+            if result is None or not valid(seq):
+                # Skipped, or overwritten by the capture process while we
+                # were working on it
+                continue
+            logger.debug("Frame %d latency: %f mode: %s" % (seq, result.latency,
+                                                           getattr(detector, 'mode', '')))
+            cv2.imshow("preview", render(image, result))
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
+    if args.networktables:
+        ntw = NTWrapper(finder, args.udp, args.budget / 1000.0 if args.budget else None)
+        if args.gate:
+            ntw.tracker = MotionGate(ntw.tracker)
+        if args.workers > 1:
+            pool = None
+            try:
+                for seq, timestamp, image in source:
+                    if pool is None:
+                        pool = VisionWorkerPool(image.shape, args.workers, ntw.publish, finder)
+                    pool.submit(image, timestamp)
+            finally:
+                if pool is not None:
+                    pool.close()
+        else:
+            for seq, timestamp, image in source:
+                result = ntw.tracker.detect(image, None, timestamp)
+                if result is not None and valid(seq):
+                    ntw.publish(result)
+    if isinstance(source, FrameGrabber):
+        source.stop()
+        logger.info("Dropped %d of %d frames" % (source.dropped, source.frames))